@@ -142,6 +142,11 @@ doc_events = {
 
 scheduler_events = {
     "cron": {
+        "* * * * *": [
+            "woocommerce_softland.woocommerce.woocommerce_api.probe_open_circuit_breakers",
+            "woocommerce_softland.tasks.utils.flush_woocommerce_request_logs",
+            "woocommerce_softland.tasks.webhooks.enqueue_webhook_delivery_drain",
+        ],
         "0 0 * * *": [
             "woocommerce_softland.tasks.stock_update.update_stock_levels_for_all_enabled_items_in_background",
             "woocommerce_softland.tasks.sync_item_prices.run_item_price_sync_in_background",
@@ -180,6 +185,7 @@ before_tests = "woocommerce_softland.setup.utils.before_tests"
 
 ignore_links_on_delete = [
 	"WooCommerce Request Log",
+	"WooCommerce Webhook Delivery",
 ]
 
 # Request Events
@@ -235,6 +241,7 @@ fixtures = [
 					"Customer-woocommerce_server",
 					"Customer-woocommerce_identifier",
 					"Customer-woocommerce_is_guest",
+					"Customer-custom_woocommerce_sync_hash",
 					"Sales Order-woocommerce_id",
 					"Sales Order-woocommerce_server",
 					"Sales Order-woocommerce_status",
@@ -255,4 +262,5 @@ fixtures = [
 
 default_log_clearing_doctypes = {
 	"WooCommerce Request Log": 7,
+	"WooCommerce Webhook Delivery": 7,
 }
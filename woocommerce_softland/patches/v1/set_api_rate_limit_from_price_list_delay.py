@@ -0,0 +1,39 @@
+from __future__ import unicode_literals
+
+import traceback
+
+import frappe
+from frappe import _
+
+
+def execute():
+	"""
+	Set the newly created 'Rate Limit' field from the removed 'Delay per POST Request' field for all
+	WooCommerce Servers, so that servers that were throttled stay throttled
+	"""
+	try:
+		# Reload doc to ensure that the new fields `api_rate_limit` and `api_rate_limit_burst` exist
+		frappe.reload_doc("woocommerce", "doctype", "WooCommerce Server")
+
+		if not frappe.db.has_column("WooCommerce Server", "price_list_delay_per_item"):
+			return
+
+		wc_servers = frappe.db.sql(
+			"""
+			SELECT name, price_list_delay_per_item
+			FROM `tabWooCommerce Server`
+			WHERE price_list_delay_per_item > 0
+			""",
+			as_dict=True,
+		)
+		for wc_server in wc_servers:
+			frappe.db.set_value(
+				"WooCommerce Server",
+				wc_server.name,
+				{"api_rate_limit": 1 / wc_server.price_list_delay_per_item, "api_rate_limit_burst": 1},
+				update_modified=False,
+			)
+
+	except Exception as err:
+		print(_("Failed to set 'Rate Limit' field on WooCommerce Server"))
+		print(traceback.format_exception(err))
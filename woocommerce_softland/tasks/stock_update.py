@@ -1,10 +1,37 @@
 import math
+from dataclasses import dataclass
+from functools import partial
+from time import sleep
+from typing import Dict, List, Optional, Tuple
 
 import frappe
+from frappe import qb
+from frappe.query_builder import Case, Criterion
+from frappe.query_builder.functions import Coalesce, Min, Sum
+from frappe.utils import add_days, get_datetime, now_datetime
 
-from woocommerce_softland.tasks.utils import APIWithRequestLogging
+from woocommerce_softland.woocommerce.woocommerce_api import get_api_client
 
-verify_ssl = not frappe._dev_server
+# WooCommerce accepts at most 100 objects per batch request
+WC_BATCH_LIMIT = 100
+STOCK_UPDATES_PER_JOB = 1000
+
+# Stock updates triggered by transactions are collected for this many seconds, then posted together
+STOCK_UPDATE_DEBOUNCE_SECONDS = 5
+STOCK_UPDATE_QUEUE_KEY = "woocommerce_stock_update_queue"
+STOCK_UPDATE_FLUSH_SCHEDULED_KEY = "woocommerce_stock_update_flush_scheduled"
+
+
+@dataclass
+class StockUpdate:
+	"""Stock level of an item, to be posted to a WooCommerce product or variation"""
+
+	item_code: str
+	woocommerce_server: str
+	woocommerce_id: str
+	parent_woocommerce_id: Optional[str]
+	stock_quantity: int
+	item_woocommerce_server: Optional[str] = None
 
 
 def update_stock_levels_for_woocommerce_item(doc, method):
@@ -22,43 +49,72 @@ def update_stock_levels_for_woocommerce_item(doc, method):
 				if doc.doctype == "Sales Invoice":
 					if doc.update_stock == 0:
 						return
-				item_codes = [row.item_code for row in doc.items]
-				for item_code in item_codes:
-					frappe.enqueue(
-						"woocommerce_softland.tasks.stock_update.update_stock_levels_on_woocommerce_site",
-						enqueue_after_commit=True,
-						item_code=item_code,
-					)
+				item_codes = {row.item_code for row in doc.items}
+				frappe.db.after_commit.add(partial(queue_stock_updates, item_codes))
 
 
-def update_stock_levels_for_all_enabled_items_in_background():
+def queue_stock_updates(item_codes):
 	"""
-	Get all enabled ERPNext Items and post stock updates to WooCommerce
+	Add items to the queue of items that require a stock update, and schedule a job to post the
+	stock updates if none is scheduled yet. Items are queued in a Redis set, so an item that is
+	queued more than once before the job runs is only updated once.
 	"""
-	erpnext_items = []
-	current_page_length = 500
-	start = 0
+	if not item_codes:
+		return
 
-	# Get all items, 500 records at a time
-	while current_page_length == 500:
-		items = frappe.db.get_all(
-			doctype="Item",
-			filters={"disabled": 0},
-			fields=["name"],
-			start=start,
-			page_length=500,
-		)
-		erpnext_items.extend(items)
-		current_page_length = len(items)
-		start += current_page_length
+	frappe.cache.sadd(STOCK_UPDATE_QUEUE_KEY, *item_codes)
+
+	# Only schedule a job if none is pending. The flag expires in case the job never runs.
+	flush_scheduled_key = frappe.cache.make_key(STOCK_UPDATE_FLUSH_SCHEDULED_KEY)
+	if frappe.cache.set(flush_scheduled_key, 1, nx=True, ex=STOCK_UPDATE_DEBOUNCE_SECONDS * 60):
+		frappe.enqueue("woocommerce_softland.tasks.stock_update.post_queued_stock_updates")
 
-	for item in erpnext_items:
+
+def post_queued_stock_updates():
+	"""
+	Post stock updates for all queued items, after waiting for more items to be queued
+	"""
+	sleep(STOCK_UPDATE_DEBOUNCE_SECONDS)
+
+	# Clear the flag before taking the queue, so that items queued from now on schedule a new job
+	frappe.cache.delete_value(STOCK_UPDATE_FLUSH_SCHEDULED_KEY)
+
+	# Take all queued items in one atomic operation
+	queue_key = frappe.cache.make_key(STOCK_UPDATE_QUEUE_KEY)
+	pipeline = frappe.cache.pipeline()
+	pipeline.smembers(queue_key)
+	pipeline.delete(queue_key)
+	queued_item_codes, _ = pipeline.execute()
+
+	item_codes = sorted(item_code.decode() for item_code in queued_item_codes)
+	if item_codes:
+		update_stock_levels_on_woocommerce_sites(item_codes)
+
+
+def update_stock_levels_for_all_enabled_items_in_background():
+	"""
+	Get the stock levels of all enabled ERPNext Items and post stock updates to WooCommerce
+	"""
+	stock_updates = get_stock_updates()
+
+	# Enqueue a job for every chunk of stock updates, each job posts its stock updates in batches
+	for i in range(0, len(stock_updates), STOCK_UPDATES_PER_JOB):
 		frappe.enqueue(
-			"woocommerce_softland.tasks.stock_update.update_stock_levels_on_woocommerce_site",
-			item_code=item.name,
+			"woocommerce_softland.tasks.stock_update.post_stock_updates",
+			queue="long",
+			stock_updates=stock_updates[i : i + STOCK_UPDATES_PER_JOB],
 		)
 
 
+def update_stock_levels_on_woocommerce_sites(item_codes: List[str]) -> bool:
+	"""
+	Updates stock levels of a list of items on all their associated WooCommerce sites, using
+	the WooCommerce batch endpoints. Failed updates are logged individually.
+	"""
+	failed_updates = post_stock_updates(get_stock_updates(item_codes))
+	return len(failed_updates) == 0
+
+
 @frappe.whitelist()
 def update_stock_levels_on_woocommerce_site(item_code):
 	"""
@@ -73,73 +129,267 @@ def update_stock_levels_on_woocommerce_site(item_code):
 	if len(item.woocommerce_servers) == 0 or not item.is_stock_item or item.disabled:
 		return False
 	else:
-		bins = frappe.get_list(
-			"Bin", {"item_code": item_code}, ["name", "warehouse", "reserved_qty", "actual_qty"]
+		failed_updates = post_stock_updates(get_stock_updates([item_code], force=True))
+		if failed_updates:
+			raise ValueError(
+				f"Stock levels of {item_code} could not be updated on WooCommerce, see the Error Log for details"
+			)
+
+		return True
+
+
+def get_stock_updates(
+	item_codes: Optional[List[str]] = None, force: bool = False
+) -> List[StockUpdate]:
+	"""
+	Returns the stock updates that should be posted to WooCommerce, for all enabled stock items or
+	only the given items, computed in a single query.
+
+	There is a row for every enabled item/WooCommerce site link on a server with stock level
+	synchronisation enabled, with the sum of stock in the server's warehouses. Variants are only
+	included if their template is linked to the same server.
+
+	Unless force is set, rows with the same stock level as the last successful update are skipped
+	until the server's refresh interval has passed.
+	"""
+	iws = qb.DocType("Item WooCommerce Server")
+	template_iws = qb.DocType("Item WooCommerce Server").as_("template_iws")
+	item = qb.DocType("Item")
+	wc_server = qb.DocType("WooCommerce Server")
+	wc_warehouse = qb.DocType("WooCommerce Server Warehouse")
+	bin = qb.DocType("Bin")
+
+	# The joined tables below return at most one row per item and warehouse, so that duplicate
+	# warehouse or template rows do not count the same stock more than once
+
+	# The WooCommerce ID of every template on every server
+	parent_iws = (
+		qb.from_(template_iws)
+		.select(
+			template_iws.parent,
+			template_iws.woocommerce_server,
+			Min(template_iws.woocommerce_id).as_("woocommerce_id"),
+		)
+		.where(
+			(template_iws.parenttype == "Item")
+			& template_iws.woocommerce_id.isnotnull()
+			& (template_iws.woocommerce_id != "")
+		)
+		.groupby(template_iws.parent, template_iws.woocommerce_server)
+	).as_("parent_iws")
+
+	# The distinct warehouses of every server
+	server_warehouse = (
+		qb.from_(wc_warehouse)
+		.select(wc_warehouse.parent, wc_warehouse.warehouse)
+		.distinct()
+		.where(wc_warehouse.parenttype == "WooCommerce Server")
+	).as_("server_warehouse")
+
+	and_conditions = [
+		iws.parenttype == "Item",
+		iws.enabled == 1,
+		iws.woocommerce_id.isnotnull(),
+		iws.woocommerce_id != "",
+		item.disabled == 0,
+		item.is_stock_item == 1,
+		wc_server.enable_sync == 1,
+		wc_server.enable_stock_level_synchronisation == 1,
+		item.variant_of.isnull() | (item.variant_of == "") | parent_iws.woocommerce_id.isnotnull(),
+	]
+	if item_codes is not None:
+		if not item_codes:
+			return []
+		and_conditions.append(item.name.isin(item_codes))
+
+	# Subtract reserved stock if required by the WooCommerce Server
+	stock_qty = (
+		Case()
+		.when(wc_server.subtract_reserved_stock == 1, bin.actual_qty - bin.reserved_qty)
+		.else_(bin.actual_qty)
+	)
+
+	stock_levels = (
+		qb.from_(iws)
+		.inner_join(item)
+		.on(item.name == iws.parent)
+		.inner_join(wc_server)
+		.on(wc_server.name == iws.woocommerce_server)
+		.left_join(parent_iws)
+		.on(
+			(parent_iws.parent == item.variant_of)
+			& (parent_iws.woocommerce_server == iws.woocommerce_server)
+		)
+		.left_join(server_warehouse)
+		.on(server_warehouse.parent == wc_server.name)
+		.left_join(bin)
+		.on((bin.item_code == item.name) & (bin.warehouse == server_warehouse.warehouse))
+		.select(
+			item.name.as_("item_code"),
+			iws.woocommerce_server,
+			iws.woocommerce_id,
+			iws.name.as_("item_woocommerce_server"),
+			iws.woocommerce_last_stock_qty,
+			iws.woocommerce_last_stock_push,
+			wc_server.stock_level_refresh_interval,
+			parent_iws.woocommerce_id.as_("parent_woocommerce_id"),
+			Coalesce(Sum(stock_qty), 0).as_("stock_quantity"),
+		)
+		.where(Criterion.all(and_conditions))
+		.groupby(
+			iws.name,
+			item.name,
+			iws.woocommerce_server,
+			iws.woocommerce_id,
+			iws.woocommerce_last_stock_qty,
+			iws.woocommerce_last_stock_push,
+			wc_server.stock_level_refresh_interval,
+			parent_iws.woocommerce_id,
 		)
+		.run(as_dict=True)
+	)
 
-		for wc_site in item.woocommerce_servers:
-			if wc_site.woocommerce_id:
-				woocommerce_id = wc_site.woocommerce_id
-				woocommerce_server = wc_site.woocommerce_server
-				wc_server = frappe.get_cached_doc("WooCommerce Server", woocommerce_server)
-
-				if (
-					not wc_server
-					or not wc_server.enable_sync
-					or not wc_site.enabled
-					or not wc_server.enable_stock_level_synchronisation
-				):
-					continue
-
-				wc_api = APIWithRequestLogging(
-					url=wc_server.woocommerce_server_url,
-					consumer_key=wc_server.api_consumer_key,
-					consumer_secret=wc_server.api_consumer_secret,
-					version="wc/v3",
-					timeout=40,
-					verify_ssl=verify_ssl,
+	stock_updates = []
+	for stock_level in stock_levels:
+		# Round the total down (WooCommerce API doesn't accept float values)
+		stock_quantity = math.floor(stock_level.stock_quantity)
+		if force or is_stock_update_required(stock_level, stock_quantity):
+			stock_updates.append(
+				StockUpdate(
+					item_code=stock_level.item_code,
+					woocommerce_server=stock_level.woocommerce_server,
+					woocommerce_id=stock_level.woocommerce_id,
+					parent_woocommerce_id=stock_level.parent_woocommerce_id,
+					stock_quantity=stock_quantity,
+					item_woocommerce_server=stock_level.item_woocommerce_server,
 				)
+			)
+
+	return stock_updates
 
-				# Sum all quantities from select warehouses and round the total down (WooCommerce API doesn't accept float values)
-				data_to_post = {
-					"stock_quantity": math.floor(
-						sum(
-							bin.actual_qty
-							if not wc_server.subtract_reserved_stock
-							else bin.actual_qty - bin.reserved_qty
-							for bin in bins
-							if bin.warehouse in [row.warehouse for row in wc_server.warehouses]
-						)
-					)
-				}
-
-				try:
-					parent_item_id = item.variant_of
-					if parent_item_id:
-						parent_item = frappe.get_doc("Item", parent_item_id)
-						# Get the parent item's woocommerce_id
-						for parent_wc_site in parent_item.woocommerce_servers:
-							if parent_wc_site.woocommerce_server == woocommerce_server:
-								parent_woocommerce_id = parent_wc_site.woocommerce_id
-								break
-						if not parent_woocommerce_id:
-							continue
-						endpoint = f"products/{parent_woocommerce_id}/variations/{woocommerce_id}"
-					else:
-						endpoint = f"products/{woocommerce_id}"
-					response = wc_api.put(endpoint=endpoint, data=data_to_post)
-				except Exception as err:
-					error_message = f"{frappe.get_traceback()}\n\nData in PUT request: \n{str(data_to_post)}"
-					frappe.log_error("WooCommerce Error", error_message)
-					raise err
-				if response.status_code != 200:
-					error_message = f"Status Code not 200\n\nData in PUT request: \n{str(data_to_post)}"
-					error_message += (
-						f"\n\nResponse: \n{response.status_code}\nResponse Text: {response.text}\nRequest URL: {response.request.url}\nRequest Body: {response.request.body}"
-						if response is not None
-						else ""
-					)
-					frappe.log_error("WooCommerce Error", error_message)
-					raise ValueError(error_message)
 
+def is_stock_update_required(stock_level: Dict, stock_quantity: int) -> bool:
+	"""
+	Returns True if the stock level differs from the last stock level posted to WooCommerce, or if
+	it was last posted longer ago than the WooCommerce Server's refresh interval
+	"""
+	if not stock_level.woocommerce_last_stock_push:
 		return True
+	if stock_level.woocommerce_last_stock_qty != stock_quantity:
+		return True
+	if not stock_level.stock_level_refresh_interval:
+		return True
+
+	refresh_after = add_days(
+		get_datetime(stock_level.woocommerce_last_stock_push), stock_level.stock_level_refresh_interval
+	)
+	return now_datetime() >= refresh_after
+
+
+def record_posted_stock_levels(stock_updates: List[StockUpdate]) -> None:
+	"""
+	Record the stock levels that were successfully posted to WooCommerce on the Item WooCommerce
+	Server rows, so that unchanged stock levels are not posted again
+	"""
+	iws = qb.DocType("Item WooCommerce Server")
+	posted_at = now_datetime()
+
+	# Update all rows with the same stock level in one query
+	rows_by_stock_quantity: Dict[int, List[str]] = {}
+	for stock_update in stock_updates:
+		if stock_update.item_woocommerce_server:
+			rows_by_stock_quantity.setdefault(stock_update.stock_quantity, []).append(
+				stock_update.item_woocommerce_server
+			)
+
+	for stock_quantity, row_names in rows_by_stock_quantity.items():
+		(
+			qb.update(iws)
+			.set(iws.woocommerce_last_stock_qty, stock_quantity)
+			.set(iws.woocommerce_last_stock_push, posted_at)
+			.where(iws.name.isin(row_names))
+		).run()
+
+
+def post_stock_updates(stock_updates: List[StockUpdate]) -> List[StockUpdate]:
+	"""
+	Posts stock updates to WooCommerce and returns the updates that failed.
+
+	Updates are grouped per WooCommerce server into products/batch requests, and variations are
+	grouped per parent product into products/{parent}/variations/batch requests.
+	"""
+	batches: Dict[Tuple[str, Optional[str]], List[StockUpdate]] = {}
+	for stock_update in stock_updates:
+		batches.setdefault(
+			(stock_update.woocommerce_server, stock_update.parent_woocommerce_id), []
+		).append(stock_update)
+
+	failed_updates = []
+	for (woocommerce_server, parent_woocommerce_id), updates in batches.items():
+		wc_api = get_api_client(woocommerce_server)
+		endpoint = (
+			f"products/{parent_woocommerce_id}/variations/batch"
+			if parent_woocommerce_id
+			else "products/batch"
+		)
+		for i in range(0, len(updates), WC_BATCH_LIMIT):
+			failed_updates.extend(
+				post_stock_update_batch(wc_api, endpoint, updates[i : i + WC_BATCH_LIMIT])
+			)
+
+	return failed_updates
+
+
+def post_stock_update_batch(
+	wc_api, endpoint: str, updates: List[StockUpdate]
+) -> List[StockUpdate]:
+	"""
+	Posts a single batch of stock updates to WooCommerce, logs the updates that failed and returns them
+	"""
+	data_to_post = {
+		"update": [
+			{"id": update.woocommerce_id, "stock_quantity": update.stock_quantity} for update in updates
+		]
+	}
+
+	try:
+		# Setting absolute stock quantities is safe to repeat, so allow the request to be retried.
+		# Only the result of each update is needed, not the full products
+		response = wc_api.post(
+			endpoint=endpoint,
+			data=data_to_post,
+			params={"_fields": "update.id,update.error"},
+			idempotent=True,
+		)
+	except Exception:
+		error_message = f"{frappe.get_traceback()}\n\nData in POST request: \n{str(data_to_post)}"
+		frappe.log_error("WooCommerce Error", error_message)
+		return updates
+	if response.status_code != 200:
+		error_message = f"Status Code not 200\n\nData in POST request: \n{str(data_to_post)}"
+		error_message += (
+			f"\n\nResponse: \n{response.status_code}\nResponse Text: {response.text}\nRequest URL: {response.request.url}\nRequest Body: {response.request.body}"
+			if response is not None
+			else ""
+		)
+		frappe.log_error("WooCommerce Error", error_message)
+		return updates
+
+	# WooCommerce returns the result of each update in the order it was posted, with an "error" object for failed updates
+	failed_updates = []
+	posted_updates = []
+	for update, result in zip(updates, response.json().get("update", [])):
+		if "error" not in result:
+			posted_updates.append(update)
+		else:
+			error_message = (
+				f"Stock level of {update.item_code} could not be updated\n\n"
+				f"Endpoint: {endpoint}\nWooCommerce ID: {update.woocommerce_id}\n"
+				f"Stock Quantity: {update.stock_quantity}\n\nError: \n{result['error']}"
+			)
+			frappe.log_error("WooCommerce Error", error_message)
+			failed_updates.append(update)
+
+	record_posted_stock_levels(posted_updates)
+
+	return failed_updates
@@ -1,4 +1,3 @@
-from time import sleep
 from typing import List, Optional
 
 import frappe
@@ -114,7 +113,8 @@ class SynchroniseItemPrice(SynchroniseWooCommerce):
 			wc_product = frappe.get_doc({"doctype": "WooCommerce Product", "name": wc_product_name})
 
 			try:
-				wc_product.load_from_db()
+				# Only the price is needed, and only the price will be written
+				wc_product.load_from_db(fields=["regular_price"])
 
 				# If self.item_price_doc is set, set the price_list_rate accordingly, else use the price_list_rate from the price list
 				price_list_rate = (
@@ -137,5 +137,3 @@ class SynchroniseItemPrice(SynchroniseWooCommerce):
 			except Exception:
 				error_message = f"{frappe.get_traceback()}\n\n Product Data: \n{str(wc_product.as_dict())}"
 				frappe.log_error("WooCommerce Error: Price List Sync", error_message)
-
-			sleep(self.wc_server.price_list_delay_per_item)
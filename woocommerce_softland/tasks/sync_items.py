@@ -1,7 +1,7 @@
 import json
 from dataclasses import dataclass
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import Dict, Iterator, List, Optional, Tuple
 
 import frappe
 from erpnext.stock.doctype.item.item import Item
@@ -18,7 +18,11 @@ from woocommerce_softland.woocommerce.doctype.woocommerce_product.woocommerce_pr
 from woocommerce_softland.woocommerce.doctype.woocommerce_server.woocommerce_server import (
 	WooCommerceServer,
 )
+from woocommerce_softland.woocommerce.doctype.woocommerce_sync_cursor.woocommerce_sync_cursor import (
+	get_sync_cursor,
+)
 from woocommerce_softland.woocommerce.woocommerce_api import (
+	WC_RECORDS_PER_PAGE_LIMIT,
 	generate_woocommerce_record_name_from_domain_and_id,
 )
 
@@ -97,33 +101,64 @@ def run_item_sync(
 
 def sync_woocommerce_products_modified_since(date_time_from=None):
 	"""
-	Get list of WooCommerce products modified since date_time_from
+	Synchronise the WooCommerce products of every WooCommerce Server that were modified since they
+	were last synchronised.
+
+	Each server's products are scanned from its sync cursor, which is advanced after every page. If
+	date_time_from is given, the scan starts from date_time_from instead.
 	"""
 	wc_settings = frappe.get_doc("WooCommerce Integration Settings")
 
-	if not date_time_from:
-		date_time_from = wc_settings.wc_last_sync_date_items
-
-	# Validate
-	if not date_time_from:
-		error_text = _(
-			"'Last Items Syncronisation Date' field on 'WooCommerce Integration Settings' is missing"
-		)
-		frappe.log_error(
-			"WooCommerce Items Sync Task Error",
-			error_text,
+	for wc_server in WooCommerceProduct._init_api():
+		cursor = get_sync_cursor(wc_server.woocommerce_server, "Products")
+		modified_after, dates_are_gmt = cursor.get_scan_start(
+			date_time_from, default=wc_settings.wc_last_sync_date_items
 		)
-		raise ValueError(error_text)
 
-	wc_products = get_list_of_wc_products(date_time_from=date_time_from)
-	for wc_product in wc_products:
-		try:
-			run_item_sync(woocommerce_product=wc_product, enqueue=True)
-		# Skip items with errors, as these exceptions will be logged
-		except Exception:
-			pass
+		# Validate
+		if not modified_after:
+			error_text = _(
+				"'Last Items Syncronisation Date' field on 'WooCommerce Integration Settings' is missing"
+			)
+			frappe.log_error(
+				"WooCommerce Items Sync Task Error",
+				error_text,
+			)
+			raise ValueError(error_text)
+
+		for products in WooCommerceProduct.iter_modified_pages(
+			wc_server, modified_after, dates_are_gmt, fields=[]
+		):
+			# WooCommerce updates a variable product when one of its variations changes, so only the
+			# variations of variable products that have changed need to be scanned
+			changed_products = get_wc_products_requiring_sync(products)
+			variations = [
+				variation
+				for product in changed_products
+				if product["type"] == "variable"
+				for page in WooCommerceProduct.iter_modified_pages(
+					wc_server,
+					modified_after,
+					dates_are_gmt,
+					endpoint=f"products/{product['id']}/variations",
+					metadata={"parent_woocommerce_name": product["woocommerce_name"]},
+					fields=[],
+				)
+				for variation in page
+			]
+
+			# The products of the page have already been compared with their Items, so only the
+			# variations still need to be
+			for wc_product in iter_listed_wc_products(
+				changed_products + get_wc_products_requiring_sync(variations)
+			):
+				try:
+					run_item_sync(woocommerce_product=wc_product)
+				# Skip items with errors, as these exceptions will be logged
+				except Exception:
+					pass
 
-	frappe.db.set_single_value("WooCommerce Settings", "wc_last_sync_date_items", now())
+			cursor.advance(products[-1]["woocommerce_date_modified_gmt"])
 
 
 @dataclass
@@ -598,17 +633,23 @@ def get_list_of_wc_products(
 	"""
 	Fetches a list of WooCommerce Products within a specified date range or linked with an Item, using pagination.
 
+	At least one of date_time_from, item parameters are required
+	"""
+	return list(iter_wc_products(item=item, date_time_from=date_time_from))
+
+
+def iter_wc_products(
+	item: Optional[ERPNextItemToSync] = None, date_time_from: Optional[datetime] = None
+) -> Iterator[WooCommerceProduct]:
+	"""
+	Yields WooCommerce Products within a specified date range or linked with an Item, page by page.
+
 	At least one of date_time_from, item parameters are required
 	"""
 	if not any([date_time_from, item]):
 		raise ValueError("At least one of date_time_from or item parameters are required")
 
-	wc_records_per_page_limit = 100
-	page_length = wc_records_per_page_limit
-	new_results = True
-	start = 0
 	filters = []
-	wc_products = []
 	servers = None
 
 	# Build filters
@@ -618,24 +659,68 @@ def get_list_of_wc_products(
 		filters.append(["WooCommerce Product", "id", "=", item.item_woocommerce_server.woocommerce_id])
 		servers = [item.item_woocommerce_server.woocommerce_server]
 
-	while new_results:
-		woocommerce_product = frappe.get_doc({"doctype": "WooCommerce Product"})
-		new_results = woocommerce_product.get_list(
-			args={
-				"filters": filters,
-				"page_lenth": page_length,
-				"start": start,
-				"servers": servers,
-				"as_doc": True,
-			}
+	return WooCommerceProduct.iter_records(filters=filters, servers=servers, as_doc=True)
+
+
+def get_wc_products_requiring_sync(products: List[Dict]) -> List[Dict]:
+	"""
+	Returns the given listed WooCommerce Products that have changed since they were last synchronised
+	"""
+	if not products:
+		return []
+
+	# Products whose date_modified matches the sync hash of their Item have already been synchronised
+	synchronised = {
+		(row.woocommerce_server, row.woocommerce_id, row.woocommerce_last_sync_hash)
+		for row in frappe.get_all(
+			"Item WooCommerce Server",
+			filters={"woocommerce_id": ["in", list({str(product["id"]) for product in products})]},
+			fields=["woocommerce_server", "woocommerce_id", "woocommerce_last_sync_hash"],
 		)
-		for wc_product in new_results:
-			wc_products.append(wc_product)
-		start += page_length
-		if len(new_results) < page_length:
-			new_results = []
+	}
+
+	changed_products = []
+	for product in products:
+		key = (product["woocommerce_server"], str(product["id"]), product["woocommerce_date_modified"])
+		if key not in synchronised:
+			changed_products.append(product)
+	return changed_products
+
+
+def iter_listed_wc_products(products: List[Dict]) -> Iterator[WooCommerceProduct]:
+	"""
+	Yields the given WooCommerce Products in full, a page of products per request.
 
-	return wc_products
+	The products are expected to have been listed with only the attributes needed to compare them
+	with their Items. Variations are retrieved with the name of their parent product, if it is one of
+	the given products.
+	"""
+	# Group the products by endpoint, so that they can be retrieved in pages
+	parent_names = {
+		(product["woocommerce_server"], product["id"]): product["woocommerce_name"]
+		for product in products
+	}
+	product_ids_by_endpoint = {}
+	for product in products:
+		product_ids_by_endpoint.setdefault(
+			(product["woocommerce_server"], product["parent_id"]), []
+		).append(str(product["id"]))
+
+	for (woocommerce_server, parent_id), product_ids in product_ids_by_endpoint.items():
+		for i in range(0, len(product_ids), WC_RECORDS_PER_PAGE_LIMIT):
+			yield from WooCommerceProduct.iter_records(
+				filters=[
+					["WooCommerce Product", "id", "in", product_ids[i : i + WC_RECORDS_PER_PAGE_LIMIT]]
+				],
+				servers=[woocommerce_server],
+				endpoint=f"products/{parent_id}/variations" if parent_id else "products",
+				metadata=(
+					{"parent_woocommerce_name": parent_names.get((woocommerce_server, parent_id))}
+					if parent_id
+					else None
+				),
+				as_doc=True,
+			)
 
 
 def get_item_price_rate(item: ERPNextItemToSync):
@@ -1,13 +1,15 @@
+import hashlib
 import json
 from datetime import datetime
-from typing import Dict, Optional, Tuple, Union
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 
 import frappe
 from erpnext.selling.doctype.sales_order.sales_order import SalesOrder
 from erpnext.selling.doctype.sales_order_item.sales_order_item import SalesOrderItem
 from frappe import _
+from frappe.query_builder import Criterion
 from frappe.utils import get_datetime
-from frappe.utils.data import cstr, now
+from frappe.utils.data import cstr
 from jsonpath_ng.ext import parse
 
 from woocommerce_softland.exceptions import SyncDisabledError, WooCommerceOrderNotFoundError
@@ -18,9 +20,13 @@ from woocommerce_softland.woocommerce.doctype.woocommerce_order.woocommerce_orde
 	WC_ORDER_STATUS_MAPPING_REVERSE,
 	WooCommerceOrder,
 )
-from woocommerce_softland.woocommerce.woocommerce_api import (
-	generate_woocommerce_record_name_from_domain_and_id,
+from woocommerce_softland.woocommerce.doctype.woocommerce_product.woocommerce_product import (
+	WooCommerceProduct,
 )
+from woocommerce_softland.woocommerce.doctype.woocommerce_sync_cursor.woocommerce_sync_cursor import (
+	get_sync_cursor,
+)
+from woocommerce_softland.woocommerce.woocommerce_api import WC_RECORDS_PER_PAGE_LIMIT
 
 
 def run_sales_order_sync_from_hook(doc, method):
@@ -84,34 +90,51 @@ def run_sales_order_sync(
 
 def sync_woocommerce_orders_modified_since(date_time_from=None):
 	"""
-	Get list of WooCommerce orders modified since date_time_from
+	Synchronise the WooCommerce orders of every WooCommerce Server that were modified since they were
+	last synchronised.
+
+	Each server's orders, and its trashed orders, are scanned from their own sync cursor, which is
+	advanced after every page. If date_time_from is given, the scan starts from date_time_from
+	instead.
 	"""
 	wc_settings = frappe.get_doc("WooCommerce Integration Settings")
+	minimum_creation_date = wc_settings.minimum_creation_date
 
-	if not date_time_from:
-		date_time_from = wc_settings.wc_last_sync_date
+	for wc_server in WooCommerceOrder._init_api():
+		for resource, status in (("Orders", None), ("Trashed Orders", "trash")):
+			cursor = get_sync_cursor(wc_server.woocommerce_server, resource)
+			modified_after, dates_are_gmt = cursor.get_scan_start(
+				date_time_from, default=wc_settings.wc_last_sync_date
+			)
 
-	# Validate
-	if not date_time_from:
-		error_text = _(
-			"'Last Items Syncronisation Date' field on 'WooCommerce Integration Settings' is missing"
-		)
-		frappe.log_error(
-			"WooCommerce Items Sync Task Error",
-			error_text,
-		)
-		raise ValueError(error_text)
+			# Validate
+			if not modified_after:
+				error_text = _(
+					"'Last Sales Orders Syncronisation Date' field on 'WooCommerce Integration Settings' is missing"
+				)
+				frappe.log_error(
+					"WooCommerce Sales Orders Sync Task Error",
+					error_text,
+				)
+				raise ValueError(error_text)
 
-	wc_orders = get_list_of_wc_orders(date_time_from=date_time_from)
-	wc_orders += get_list_of_wc_orders(date_time_from=date_time_from, status="trash")
-	for wc_order in wc_orders:
-		try:
-			run_sales_order_sync(woocommerce_order=wc_order, enqueue=True)
-		# Skip orders with errors, as these exceptions will be logged
-		except Exception:
-			pass
+			filters = []
+			if minimum_creation_date:
+				filters.append(["WooCommerce Order", "date_created", ">", minimum_creation_date])
+			if status:
+				filters.append(["WooCommerce Order", "status", "=", status])
+
+			for orders in WooCommerceOrder.iter_modified_pages(
+				wc_server, modified_after, dates_are_gmt, filters=filters, fields=["status"]
+			):
+				for wc_order in iter_wc_orders_requiring_sync(orders, status=status):
+					try:
+						run_sales_order_sync(woocommerce_order=wc_order)
+					# Skip orders with errors, as these exceptions will be logged
+					except Exception:
+						pass
 
-	frappe.db.set_single_value("WooCommerce Settings", "wc_last_sync_date_items", now())
+				cursor.advance(orders[-1]["woocommerce_date_modified_gmt"])
 
 
 class SynchroniseSalesOrder(SynchroniseWooCommerce):
@@ -377,13 +400,14 @@ class SynchroniseSalesOrder(SynchroniseWooCommerce):
 			wc_order.status = sales_order_wc_status
 			wc_order_dirty = True
 
-		# Get the Item WooCommerce ID's
+		# Get the Item WooCommerce ID's, using the first link of an Item to the WooCommerce Server
+		woocommerce_ids = {}
+		for linked_item in get_linked_items(
+			wc_order.woocommerce_server, item_codes=[so_item.item_code for so_item in sales_order.items]
+		):
+			woocommerce_ids.setdefault(linked_item.item_code, linked_item.woocommerce_id)
 		for so_item in sales_order.items:
-			so_item.woocommerce_id = frappe.get_value(
-				"Item WooCommerce Server",
-				filters={"parent": so_item.item_code, "woocommerce_server": wc_order.woocommerce_server},
-				fieldname="woocommerce_id",
-			)
+			so_item.woocommerce_id = woocommerce_ids.get(so_item.item_code)
 
 		# Update the line_items field if necessary
 		wc_server = frappe.get_cached_doc("WooCommerce Server", wc_order.woocommerce_server)
@@ -567,45 +591,49 @@ class SynchroniseSalesOrder(SynchroniseWooCommerce):
 		else:
 			customer_identifier = customer_woo_com_email
 
-		# Check if customer exists using the identifier
-
-		existing_customer = frappe.get_value(
-			"Customer", {"woocommerce_identifier": customer_identifier}, "name"
+		# Check if customer exists using the (indexed) identifier. If the customer's details have not
+		# changed since they were last synchronised, there is nothing to update.
+		customer_sync_hash = get_customer_sync_hash(
+			customer_identifier, raw_billing_data, raw_shipping_data
+		)
+		existing_customer = frappe.db.get_value(
+			"Customer",
+			{"woocommerce_identifier": customer_identifier},
+			["name", "custom_woocommerce_sync_hash"],
+			as_dict=True,
 		)
+		if existing_customer and existing_customer.custom_woocommerce_sync_hash == customer_sync_hash:
+			return existing_customer.name
 
+		customer_name = company_name if company_name else individual_name
 		if not existing_customer:
 			# Create Customer
 			customer = frappe.new_doc("Customer")
 			customer.woocommerce_identifier = customer_identifier
 			customer.customer_type = "Company" if company_name else "Individual"
 			customer.woocommerce_is_guest = is_guest
+			self.set_customer_fields(customer, customer_name, customer_identifier, raw_billing_data)
+
+			try:
+				customer.save()
+			except Exception:
+				error_message = f"{frappe.get_traceback()}\n\nCustomer Data{str(customer.as_dict())}"
+				frappe.log_error("WooCommerce Error", error_message)
 		else:
 			# Edit Customer
-			customer = frappe.get_doc("Customer", existing_customer)
-
-		customer.customer_name = company_name if company_name else individual_name
-		customer.woocommerce_identifier = customer_identifier
-
-		# Check if vat_id exists in raw_billing_data and is a valid string
-		vat_id = raw_billing_data.get("vat_id")
-
-		if isinstance(vat_id, str) and vat_id.strip():
-			customer.tax_id = vat_id
-
-		customer.flags.ignore_mandatory = True
-
-		try:
-			customer.save()
-		except Exception:
-			error_message = f"{frappe.get_traceback()}\n\nCustomer Data{str(customer.as_dict())}"
-			frappe.log_error("WooCommerce Error", error_message)
-		finally:
-			self.customer = customer
+			customer = frappe.get_doc("Customer", existing_customer.name)
+			self.set_customer_fields(customer, customer_name, customer_identifier, raw_billing_data)
 
+		self.customer = customer
 		self.create_or_update_address(wc_order)
 		contact = create_contact(raw_billing_data, self.customer)
+
+		# Save the Customer once, after its Addresses and Contact have been updated
 		self.customer.reload()
-		self.customer.customer_primary_contact = contact.name
+		self.set_customer_fields(self.customer, customer_name, customer_identifier, raw_billing_data)
+		if contact:
+			self.customer.customer_primary_contact = contact.name
+		self.customer.custom_woocommerce_sync_hash = customer_sync_hash
 		try:
 			self.customer.save()
 		except Exception:
@@ -614,19 +642,74 @@ class SynchroniseSalesOrder(SynchroniseWooCommerce):
 
 		return customer.name
 
+	@staticmethod
+	def set_customer_fields(
+		customer, customer_name: str, customer_identifier: str, raw_billing_data: Dict
+	):
+		"""
+		Set the fields of a Customer from a WooCommerce Order's billing details
+		"""
+		customer.customer_name = customer_name
+		customer.woocommerce_identifier = customer_identifier
+
+		# Check if vat_id exists in raw_billing_data and is a valid string
+		vat_id = raw_billing_data.get("vat_id")
+
+		if isinstance(vat_id, str) and vat_id.strip():
+			customer.tax_id = vat_id
+
+		customer.flags.ignore_mandatory = True
+
 	def create_missing_items(self, wc_order, items_list, woocommerce_site):
 		"""
-		Searching for items linked to multiple WooCommerce sites
+		Searching for items linked to multiple WooCommerce sites.
+
+		Products that are already linked to an Item are not retrieved from WooCommerce. The missing
+		products are retrieved in as few requests as possible: one for products, and one for the
+		variations of each variable product.
 		"""
+		line_items = {}
 		for item_data in items_list:
 			item_woo_com_id = cstr(item_data.get("variation_id") or item_data.get("product_id"))
 
 			# Deleted items will have a "0" for variation_id/product_id
 			if item_woo_com_id != "0":
-				woocommerce_product_name = generate_woocommerce_record_name_from_domain_and_id(
-					woocommerce_site, item_woo_com_id
-				)
-				run_item_sync(woocommerce_product_name=woocommerce_product_name)
+				line_items[item_woo_com_id] = item_data
+
+		# Items that are disabled for sync will still be synced if it is ordered on WooCommerce
+		linked_woocommerce_ids = {
+			linked_item.woocommerce_id
+			for linked_item in get_linked_items(woocommerce_site, woocommerce_ids=list(line_items))
+			if linked_item.link_enabled
+		}
+
+		# Group the missing products by parent product, so that variations are retrieved per parent
+		missing_product_ids = {}
+		for item_woo_com_id, item_data in line_items.items():
+			if item_woo_com_id not in linked_woocommerce_ids:
+				parent_id = item_data.get("product_id") if item_data.get("variation_id") else None
+				missing_product_ids.setdefault(parent_id, []).append(item_woo_com_id)
+
+		for parent_id, product_ids in missing_product_ids.items():
+			parent_name = next(
+				(
+					item_data.get("parent_name")
+					for item_data in items_list
+					if parent_id and item_data.get("product_id") == parent_id
+				),
+				None,
+			)
+			for i in range(0, len(product_ids), WC_RECORDS_PER_PAGE_LIMIT):
+				for woocommerce_product in WooCommerceProduct.iter_records(
+					filters=[
+						["WooCommerce Product", "id", "in", product_ids[i : i + WC_RECORDS_PER_PAGE_LIMIT]]
+					],
+					servers=[woocommerce_site],
+					endpoint=f"products/{parent_id}/variations" if parent_id else "products",
+					metadata={"parent_woocommerce_name": parent_name} if parent_name else None,
+					as_doc=True,
+				):
+					run_item_sync(woocommerce_product=woocommerce_product)
 
 	def set_items_in_sales_order(self, new_sales_order, wc_order):
 		"""
@@ -637,42 +720,44 @@ class SynchroniseSalesOrder(SynchroniseWooCommerce):
 		if not wc_server.warehouse:
 			frappe.throw(_("Please set Warehouse in WooCommerce Server"))
 
-		for item in json.loads(wc_order.line_items):
+		line_items = json.loads(wc_order.line_items)
+
+		# Get the Items of all line items at once
+		linked_items = {}
+		for linked_item in get_linked_items(
+			new_sales_order.woocommerce_server,
+			woocommerce_ids=[item.get("variation_id") or item.get("product_id") for item in line_items],
+			exclude_disabled_items=True,
+		):
+			linked_items.setdefault(linked_item.woocommerce_id, linked_item)
+
+		# If we are applying a Sales Taxes and Charges Template (as opposed to Actual Tax), then we need to
+		# determine if the item price should include tax or not
+		use_tax_template = wc_server.enable_tax_lines_sync and not wc_server.use_actual_tax_type
+		if use_tax_template:
+			tax_template = frappe.get_cached_doc(
+				"Sales Taxes and Charges Template", wc_server.sales_taxes_and_charges_template
+			)
+			rate_includes_tax = tax_template.taxes[0].included_in_print_rate
+
+		for item in line_items:
 			woocomm_item_id = item.get("variation_id") or item.get("product_id")
 
 			# Deleted items will have a "0" for variation_id/product_id
 			if woocomm_item_id == 0:
-				found_item = create_placeholder_item(new_sales_order)
+				placeholder_item = create_placeholder_item(new_sales_order)
+				found_item = frappe._dict(
+					item_code=placeholder_item.name, item_name=placeholder_item.item_name
+				)
 			else:
-				iws = frappe.qb.DocType("Item WooCommerce Server")
-				itm = frappe.qb.DocType("Item")
-				item_codes = (
-					frappe.qb.from_(iws)
-					.join(itm)
-					.on(iws.parent == itm.name)
-					.where(
-						(iws.woocommerce_id == cstr(woocomm_item_id))
-						& (iws.woocommerce_server == new_sales_order.woocommerce_server)
-						& (itm.disabled == 0)
-					)
-					.select(iws.parent)
-					.limit(1)
-				).run(as_dict=True)
-
-				found_item = frappe.get_doc("Item", item_codes[0].parent) if item_codes else None
+				found_item = linked_items.get(cstr(woocomm_item_id))
 
 			rate = item.get("price")
-			# If we are applying a Sales Taxes and Charges Template (as opposed to Actual Tax), then we need to
-			# determine if the item price should include tax or not
-			if wc_server.enable_tax_lines_sync and not wc_server.use_actual_tax_type:
-				tax_template = frappe.get_cached_doc(
-					"Sales Taxes and Charges Template", wc_server.sales_taxes_and_charges_template
-				)
-				if tax_template.taxes[0].included_in_print_rate:
-					rate = get_tax_inc_price_for_woocommerce_line_item(item)
+			if use_tax_template and rate_includes_tax:
+				rate = get_tax_inc_price_for_woocommerce_line_item(item)
 
 			new_sales_order_line = {
-				"item_code": found_item.name,
+				"item_code": found_item.item_code,
 				"item_name": found_item.item_name,
 				"description": found_item.item_name,
 				"delivery_date": new_sales_order.delivery_date,
@@ -690,15 +775,15 @@ class SynchroniseSalesOrder(SynchroniseWooCommerce):
 				new_sales_order_line,
 			)
 
-			if wc_server.enable_tax_lines_sync:
-				if not wc_server.use_actual_tax_type:
-					new_sales_order.taxes_and_charges = wc_server.sales_taxes_and_charges_template
+			if wc_server.enable_tax_lines_sync and wc_server.use_actual_tax_type:
+				ordered_items_tax = item.get("total_tax")
+				add_tax_details(new_sales_order, ordered_items_tax, "Ordered Item tax", wc_server.tax_account)
 
-					# Trigger taxes calculation
-					new_sales_order.set_missing_lead_customer_details()
-				else:
-					ordered_items_tax = item.get("total_tax")
-					add_tax_details(new_sales_order, ordered_items_tax, "Ordered Item tax", wc_server.tax_account)
+		# Apply the template's taxes once all lines have been added, and before any other tax rows are added.
+		# Totals are calculated once, when the Sales Order is saved.
+		if use_tax_template and new_sales_order.items:
+			new_sales_order.taxes_and_charges = wc_server.sales_taxes_and_charges_template
+			new_sales_order.set_missing_lead_customer_details()
 
 		# If a Shipping Rule is added, shipping charges will be determined by the Shipping Rule. If not, then
 		# get it from the WooCommerce Order
@@ -932,17 +1017,25 @@ def get_list_of_wc_orders(
 	"""
 	Fetches a list of WooCommerce Orders within a specified date range or linked with a Sales Order, using pagination.
 
+	At least one of date_time_from, or sales_order parameters are required
+	"""
+	return list(iter_wc_orders(date_time_from=date_time_from, sales_order=sales_order, status=status))
+
+
+def iter_wc_orders(
+	date_time_from: Optional[datetime] = None,
+	sales_order: Optional[SalesOrder] = None,
+	status: Optional[str] = None,
+) -> Iterator[WooCommerceOrder]:
+	"""
+	Yields WooCommerce Orders within a specified date range or linked with a Sales Order, page by page.
+
 	At least one of date_time_from, or sales_order parameters are required
 	"""
 	if not any([date_time_from, sales_order]):
 		raise ValueError("At least one of date_time_from or sales_order parameters are required")
 
-	wc_records_per_page_limit = 100
-	page_length = wc_records_per_page_limit
-	new_results = True
-	start = 0
 	filters = []
-	wc_orders = []
 
 	wc_settings = frappe.get_cached_doc("WooCommerce Integration Settings")
 	minimum_creation_date = wc_settings.minimum_creation_date
@@ -957,18 +1050,63 @@ def get_list_of_wc_orders(
 	if status:
 		filters.append(["WooCommerce Order", "status", "=", status])
 
-	while new_results:
-		woocommerce_order = frappe.get_doc({"doctype": "WooCommerce Order"})
-		new_results = woocommerce_order.get_list(
-			args={"filters": filters, "page_lenth": page_length, "start": start, "as_doc": True}
-		)
-		for wc_order in new_results:
-			wc_orders.append(wc_order)
-		start += page_length
-		if len(new_results) < page_length:
-			new_results = []
+	return WooCommerceOrder.iter_records(filters=filters, as_doc=True)
 
-	return wc_orders
+
+def iter_wc_orders_requiring_sync(
+	orders: List[Dict], status: Optional[str] = None
+) -> Iterator[WooCommerceOrder]:
+	"""
+	Yields the given WooCommerce Orders that have changed since they were last synchronised, or whose
+	Sales Order still needs a Payment Entry.
+
+	The orders are expected to have been listed with only the attributes needed to compare them with
+	their Sales Orders. Only the orders that need to be synchronised are retrieved in full, a page of
+	orders per request.
+	"""
+	if not orders:
+		return
+
+	# Use the same Sales Order that SynchroniseSalesOrder would find for each order
+	sales_orders = {}
+	for sales_order in frappe.get_all(
+		"Sales Order",
+		filters={"woocommerce_id": ["in", list({str(order["id"]) for order in orders})]},
+		fields=[
+			"woocommerce_server",
+			"woocommerce_id",
+			"docstatus",
+			"custom_woocommerce_last_sync_hash",
+			"woocommerce_payment_entry",
+			"custom_attempted_woocommerce_auto_payment_entry",
+		],
+	):
+		key = (sales_order.woocommerce_server, sales_order.woocommerce_id)
+		sales_orders.setdefault(key, sales_order)
+
+	changed_order_ids = {}
+	for order in orders:
+		sales_order = sales_orders.get((order["woocommerce_server"], str(order["id"])))
+		if (
+			sales_order
+			and sales_order.custom_woocommerce_last_sync_hash == order["woocommerce_date_modified"]
+			and not (
+				sales_order.docstatus == 1
+				and not sales_order.woocommerce_payment_entry
+				and not sales_order.custom_attempted_woocommerce_auto_payment_entry
+			)
+		):
+			continue
+		changed_order_ids.setdefault(order["woocommerce_server"], []).append(str(order["id"]))
+
+	for woocommerce_server, order_ids in changed_order_ids.items():
+		for i in range(0, len(order_ids), WC_RECORDS_PER_PAGE_LIMIT):
+			filters = [["WooCommerce Order", "id", "in", order_ids[i : i + WC_RECORDS_PER_PAGE_LIMIT]]]
+			if status:
+				filters.append(["WooCommerce Order", "status", "=", status])
+			yield from WooCommerceOrder.iter_records(
+				filters=filters, servers=[woocommerce_server], as_doc=True
+			)
 
 
 def rename_address(address, customer):
@@ -980,6 +1118,31 @@ def rename_address(address, customer):
 	frappe.rename_doc("Address", old_address_title, new_address_title)
 
 
+def get_customer_sync_hash(customer_identifier: str, billing: Dict, shipping: Dict) -> str:
+	"""
+	Returns a hash of the normalised customer, address and contact details of a WooCommerce Order,
+	used to detect if a Customer needs to be updated
+	"""
+	address_keys = (
+		"first_name",
+		"last_name",
+		"company",
+		"address_1",
+		"address_2",
+		"city",
+		"state",
+		"postcode",
+		"country",
+		"phone",
+	)
+	details = {
+		"customer_identifier": customer_identifier,
+		"billing": {key: cstr(billing.get(key)).strip() for key in (*address_keys, "email", "vat_id")},
+		"shipping": {key: cstr(shipping.get(key)).strip() for key in address_keys},
+	}
+	return hashlib.sha256(json.dumps(details, sort_keys=True).encode()).hexdigest()
+
+
 def create_contact(data, customer):
 	email = data.get("email", None)
 	phone = data.get("phone", None)
@@ -1051,6 +1214,49 @@ def create_placeholder_item(sales_order: SalesOrder):
 	return item
 
 
+def get_linked_items(
+	woocommerce_server: str,
+	woocommerce_ids: Optional[List[Union[int, str]]] = None,
+	item_codes: Optional[List[str]] = None,
+	exclude_disabled_items: bool = False,
+) -> List[frappe._dict]:
+	"""
+	Returns the item_code, item_name, woocommerce_id, item_disabled and link_enabled flags of Items
+	that are linked to a WooCommerce Server, filtered by WooCommerce ID's and/or Item codes, using a
+	single query
+	"""
+	woocommerce_ids = {cstr(woocommerce_id) for woocommerce_id in woocommerce_ids or []} - {"", "0"}
+	item_codes = set(item_codes or [])
+	if not woocommerce_ids and not item_codes:
+		return []
+
+	iws = frappe.qb.DocType("Item WooCommerce Server")
+	itm = frappe.qb.DocType("Item")
+
+	and_conditions = [iws.woocommerce_server == woocommerce_server]
+	if woocommerce_ids:
+		and_conditions.append(iws.woocommerce_id.isin(list(woocommerce_ids)))
+	if item_codes:
+		and_conditions.append(iws.parent.isin(list(item_codes)))
+	if exclude_disabled_items:
+		and_conditions.append(itm.disabled == 0)
+
+	return (
+		frappe.qb.from_(iws)
+		.join(itm)
+		.on(iws.parent == itm.name)
+		.where(Criterion.all(and_conditions))
+		.select(
+			itm.name.as_("item_code"),
+			itm.item_name,
+			iws.woocommerce_id,
+			itm.disabled.as_("item_disabled"),
+			iws.enabled.as_("link_enabled"),
+		)
+		.orderby(iws.creation)
+	).run(as_dict=True)
+
+
 def get_addresses_linking_to(doctype, docname, fields=None):
 	"""Return a list of Addresses containing a link to the given document."""
 	return frappe.get_all(
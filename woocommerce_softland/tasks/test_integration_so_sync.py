@@ -1,3 +1,5 @@
+import json
+import time
 from unittest.mock import patch
 
 import frappe
@@ -7,6 +9,7 @@ from erpnext.stock.doctype.item.test_item import create_item
 from parameterized import parameterized
 
 from woocommerce_softland.tasks.sync_sales_orders import (
+	SynchroniseSalesOrder,
 	get_addresses_linking_to,
 	get_tax_inc_price_for_woocommerce_line_item,
 	run_sales_order_sync,
@@ -217,6 +220,49 @@ class TestIntegrationWooCommerceSync(TestIntegrationWooCommerce):
 		# Delete order in WooCommerce
 		self.delete_woocommerce_order(wc_order_id=wc_order_id)
 
+	def test_sync_create_sales_order_with_200_lines(self, mock_log_error):
+		"""
+		Benchmark building a Sales Order with 200 lines and a Sales Taxes and Charges Template from a
+		WooCommerce Order. The elapsed time is reported, and only a generous upper bound is asserted so
+		that the benchmark does not fail on slow machines
+		"""
+		# Setup
+		wc_server = frappe.get_doc("WooCommerce Server", self.wc_server.name)
+		wc_server.use_actual_tax_type = 0
+		wc_server.sales_taxes_and_charges_template = self._create_sales_taxes_and_charges_template(
+			wc_server, rate=15, included_in_rate=True
+		)
+		wc_server.flags.ignore_mandatory = True
+		wc_server.shipping_rule_map = []
+		wc_server.save()
+
+		# Create a new order in WooCommerce, and repeat its line item 200 times
+		wc_order_id, wc_order_name = self.post_woocommerce_order(item_price=10, item_qty=1)
+		wc_order = frappe.get_doc({"doctype": "WooCommerce Order", "name": wc_order_name})
+		wc_order.load_from_db()
+		line_item = json.loads(wc_order.line_items)[0]
+		wc_order.line_items = json.dumps([{**line_item, "id": line_item["id"] + i} for i in range(200)])
+
+		# Build the Sales Order
+		start = time.perf_counter()
+		SynchroniseSalesOrder(woocommerce_order=wc_order).create_sales_order(wc_order)
+		duration = time.perf_counter() - start
+		print(f"Building a 200-line Sales Order took {duration:.3f}s")
+
+		# Expect no errors logged
+		mock_log_error.assert_not_called()
+
+		# Expect newly created Sales Order in ERPNext, with the tax template applied once
+		sales_order_name = frappe.get_value("Sales Order", {"woocommerce_id": wc_order_id}, "name")
+		self.assertIsNotNone(sales_order_name)
+		sales_order = frappe.get_doc("Sales Order", sales_order_name)
+		self.assertEqual(len(sales_order.items), 200)
+		self.assertEqual(len([tax for tax in sales_order.taxes if tax.charge_type == "On Net Total"]), 1)
+		self.assertLess(duration, 120)
+
+		# Delete order in WooCommerce
+		self.delete_woocommerce_order(wc_order_id=wc_order_id)
+
 	def test_sync_create_new_sales_order_and_pe(self, mock_log_error):
 		"""
 		Test that the Sales Order Synchronisation method creates a new Sales orders and a Payment Entry
@@ -4,12 +4,20 @@ from urllib.parse import urlparse
 import frappe
 from erpnext import get_default_company
 from erpnext.stock.doctype.item.test_item import create_item
+from erpnext.stock.doctype.stock_entry.stock_entry_utils import make_stock_entry
 
-from woocommerce_softland.tasks.stock_update import update_stock_levels_on_woocommerce_site
+from woocommerce_softland.tasks.stock_update import (
+	get_stock_updates,
+	update_stock_levels_on_woocommerce_site,
+)
 from woocommerce_softland.tasks.test_integration_helpers import (
 	TestIntegrationWooCommerce,
 	get_woocommerce_server,
 )
+from woocommerce_softland.tasks.test_integration_items_sync import (
+	create_item_attribute,
+	create_variant_item,
+)
 
 
 class TestIntegrationWooCommerceStockSync(TestIntegrationWooCommerce):
@@ -79,3 +87,79 @@ class TestIntegrationWooCommerceStockSync(TestIntegrationWooCommerce):
 		# Expect correct stock level of 6.9 rounded down in WooCommerce (WooCommerce API doesn't accept float values)
 		wc_stock_level = self.get_woocommerce_product_stock_level(product_id=wc_product_id)
 		self.assertEqual(wc_stock_level, math.floor(6.9))
+
+	def test_stock_levels_are_summed_over_the_server_warehouses(self):
+		"""
+		Test that the stock levels query sums the stock in the WooCommerce Server's warehouses only, once
+		per warehouse, subtracts reserved stock and links variants to their template's WooCommerce ID
+		"""
+		suffix = frappe.generate_hash(length=6)
+
+		# List the server's warehouse twice, and subtract reserved stock
+		row = self.wc_server.append("warehouses")
+		row.warehouse = "Stores - SC"
+		self.wc_server.subtract_reserved_stock = 1
+		self.wc_server.save()
+		self.addCleanup(
+			frappe.db.set_value, "WooCommerce Server", self.wc_server.name, "subtract_reserved_stock", 0
+		)
+
+		# A simple item with stock in the server's warehouse and in another warehouse
+		item = create_item(
+			f"ITEM_STOCK_{suffix}",
+			valuation_rate=10,
+			warehouse="Stores - SC",
+			company=get_default_company(),
+			opening_stock=5,
+		)
+		make_stock_entry(
+			item_code=item.name,
+			target="Finished Goods - SC",
+			qty=20,
+			rate=10,
+			company=get_default_company(),
+		)
+		frappe.db.set_value(
+			"Bin", {"item_code": item.name, "warehouse": "Stores - SC"}, "reserved_qty", 2
+		)
+		link_item_to_woocommerce_server(item, self.wc_server.name, "900001")
+
+		# A variant with stock, whose template is linked twice to the same server
+		create_item_attribute("Material Type")
+		template = create_item(f"ITEM_STOCK_TEMPLATE_{suffix}", valuation_rate=10)
+		template.has_variants = 1
+		template.append("attributes", {"attribute": "Material Type"})
+		link_item_to_woocommerce_server(template, self.wc_server.name, "900002")
+		link_item_to_woocommerce_server(template, self.wc_server.name, "900002")
+		variant = create_variant_item(
+			f"ITEM_STOCK_VARIANT_{suffix}",
+			valuation_rate=10,
+			variant_of=template.name,
+			attributes=[("Material Type", "Option 1")],
+		)
+		make_stock_entry(
+			item_code=variant.name, target="Stores - SC", qty=4, rate=10, company=get_default_company()
+		)
+		link_item_to_woocommerce_server(variant, self.wc_server.name, "900003")
+
+		stock_updates = {
+			stock_update.item_code: stock_update
+			for stock_update in get_stock_updates([item.name, variant.name], force=True)
+		}
+
+		# Only stock in the server's warehouse, less reserved stock, counted once
+		self.assertEqual(stock_updates[item.name].stock_quantity, 3)
+		self.assertIsNone(stock_updates[item.name].parent_woocommerce_id)
+		self.assertEqual(stock_updates[variant.name].stock_quantity, 4)
+		self.assertEqual(stock_updates[variant.name].parent_woocommerce_id, "900002")
+
+
+def link_item_to_woocommerce_server(item, woocommerce_server: str, woocommerce_id: str):
+	"""
+	Link an Item to a WooCommerce product, without triggering a synchronisation
+	"""
+	row = item.append("woocommerce_servers")
+	row.woocommerce_server = woocommerce_server
+	row.woocommerce_id = woocommerce_id
+	item.flags.created_by_sync = True
+	item.save()
@@ -1,12 +1,17 @@
 from unittest.mock import MagicMock, Mock, call, patch
 
 import frappe
-from frappe import _dict
 from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_days, now_datetime
 
 from woocommerce_softland.tasks.stock_update import (
+	StockUpdate,
+	is_stock_update_required,
+	post_queued_stock_updates,
+	queue_stock_updates,
 	update_stock_levels_for_all_enabled_items_in_background,
 	update_stock_levels_on_woocommerce_site,
+	update_stock_levels_on_woocommerce_sites,
 )
 
 
@@ -16,8 +21,11 @@ class TestWooCommerceStockSync(FrappeTestCase):
 		super().setUpClass()  # important to call super() methods when extending TestCase.
 
 	@patch("woocommerce_softland.tasks.stock_update.frappe")
-	@patch("woocommerce_softland.tasks.stock_update.APIWithRequestLogging", autospec=True)
-	def test_update_stock_levels_on_woocommerce_site(self, mock_wc_api, mock_frappe):
+	@patch("woocommerce_softland.tasks.stock_update.get_api_client")
+	@patch("woocommerce_softland.tasks.stock_update.get_stock_updates")
+	def test_update_stock_levels_on_woocommerce_site(
+		self, mock_get_stock_updates, mock_wc_api, mock_frappe
+	):
 		# Set up a dummy item set to sync to two different WC sites
 		some_item = frappe._dict(
 			woocommerce_servers=[
@@ -28,58 +36,58 @@ class TestWooCommerceStockSync(FrappeTestCase):
 			disabled=0,
 		)
 		mock_frappe.get_doc.return_value = some_item
-
-		# Set up a dummy bin list with stock in two Warehouses
-		bin_list = [
-			frappe._dict(warehouse="Warehouse A", actual_qty=5),
-			frappe._dict(warehouse="Warehouse B", actual_qty=10),
-			frappe._dict(warehouse="Warehouse C", actual_qty=20),
-		]
-		mock_frappe.get_list.return_value = bin_list
-
-		# Set up mock return values
-		mock_frappe.get_cached_doc.side_effect = [
-			frappe._dict(
-				woocommerce_server="woo1.example.com",
-				enable_sync=1,
-				enable_stock_level_synchronisation=1,
-				warehouses=[frappe._dict(warehouse="Warehouse A"), frappe._dict(warehouse="Warehouse B")],
-			),
-			frappe._dict(
-				woocommerce_server="woo2.example.com",
-				enable_sync=1,
-				enable_stock_level_synchronisation=1,
-				warehouses=[frappe._dict(warehouse="Warehouse A"), frappe._dict(warehouse="Warehouse B")],
-			),
+		mock_get_stock_updates.return_value = [
+			StockUpdate(
+				item_code="some_item_code",
+				woocommerce_server=woocommerce_server,
+				woocommerce_id=woocommerce_id,
+				parent_woocommerce_id=None,
+				stock_quantity=15,
+			)
+			for woocommerce_id, woocommerce_server in ((1, "woo1.example.com"), (2, "woo2.example.com"))
 		]
 
 		# Mock out calls to WooCommerce API's
-		mock_put_response = Mock()
-		mock_put_response.status_code = 200
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {"update": [{"id": 1}]}
 
 		mock_api_instance = MagicMock()
-		mock_api_instance.put.return_value = mock_put_response
+		mock_api_instance.post.return_value = mock_post_response
 		mock_wc_api.return_value = mock_api_instance
 
 		# Call function under test
-		update_stock_levels_on_woocommerce_site("some_item_code")
+		self.assertTrue(update_stock_levels_on_woocommerce_site("some_item_code"))
 
-		# Assert that the inventories put calls were made with the correct arguments
-		self.assertEqual(mock_api_instance.put.call_count, 2)
-		actual_put_endpoints = [call.kwargs["endpoint"] for call in mock_api_instance.put.call_args_list]
-		actual_put_data = [call.kwargs["data"] for call in mock_api_instance.put.call_args_list]
+		# Assert that the stock levels were computed by the same query as the nightly job
+		mock_get_stock_updates.assert_called_once_with(["some_item_code"], force=True)
 
-		expected_put_endpoints = ["products/1", "products/2"]
-		expected_data = {"stock_quantity": 15}
-		expected_put_data = [expected_data for x in range(2)]
-		self.assertEqual(actual_put_endpoints, expected_put_endpoints)
-		self.assertEqual(actual_put_data, expected_put_data)
+		# Assert that a batch call was made to each server with the correct arguments
+		self.assertEqual(
+			mock_wc_api.call_args_list, [call("woo1.example.com"), call("woo2.example.com")]
+		)
+		self.assertEqual(mock_api_instance.post.call_count, 2)
+		actual_post_endpoints = [
+			call.kwargs["endpoint"] for call in mock_api_instance.post.call_args_list
+		]
+		actual_post_data = [call.kwargs["data"] for call in mock_api_instance.post.call_args_list]
+
+		expected_post_endpoints = ["products/batch", "products/batch"]
+		expected_post_data = [
+			{"update": [{"id": 1, "stock_quantity": 15}]},
+			{"update": [{"id": 2, "stock_quantity": 15}]},
+		]
+		self.assertEqual(actual_post_endpoints, expected_post_endpoints)
+		self.assertEqual(actual_post_data, expected_post_data)
 
 	@patch("woocommerce_softland.tasks.stock_update.frappe")
-	@patch("woocommerce_softland.tasks.stock_update.APIWithRequestLogging", autospec=True)
-	def test_update_stock_levels_on_woocommerce_site_variant(self, mock_wc_api, mock_frappe):
+	@patch("woocommerce_softland.tasks.stock_update.get_api_client")
+	@patch("woocommerce_softland.tasks.stock_update.get_stock_updates")
+	def test_update_stock_levels_on_woocommerce_site_variant(
+		self, mock_get_stock_updates, mock_wc_api, mock_frappe
+	):
 		# Set up a dummy variant item set to sync to a WC site
-		variant_item = frappe._dict(
+		mock_frappe.get_doc.return_value = frappe._dict(
 			woocommerce_servers=[
 				frappe._dict(woocommerce_id=101, woocommerce_server="woo1.example.com", enabled=1),
 			],
@@ -87,79 +95,171 @@ class TestWooCommerceStockSync(FrappeTestCase):
 			disabled=0,
 			variant_of="parent_item_code",
 		)
-		mock_frappe.get_doc.side_effect = [
-			variant_item,
-			frappe._dict(
-				woocommerce_servers=[
-					frappe._dict(woocommerce_id=100, woocommerce_server="woo1.example.com", enabled=1),
-				]
-			),
-		]
-
-		# Set up a dummy bin list with stock in two Warehouses
-		bin_list = [
-			frappe._dict(warehouse="Warehouse A", actual_qty=5),
-			frappe._dict(warehouse="Warehouse B", actual_qty=10),
+		mock_get_stock_updates.return_value = [
+			StockUpdate(
+				item_code="variant_item_code",
+				woocommerce_server="woo1.example.com",
+				woocommerce_id=101,
+				parent_woocommerce_id=100,
+				stock_quantity=15,
+			)
 		]
-		mock_frappe.get_list.return_value = bin_list
-
-		# Set up mock return values
-		mock_frappe.get_cached_doc.return_value = frappe._dict(
-			woocommerce_server="woo1.example.com",
-			enable_sync=1,
-			enable_stock_level_synchronisation=1,
-			warehouses=[frappe._dict(warehouse="Warehouse A"), frappe._dict(warehouse="Warehouse B")],
-		)
 
 		# Mock out calls to WooCommerce API's
-		mock_put_response = Mock()
-		mock_put_response.status_code = 200
+		mock_post_response = Mock()
+		mock_post_response.status_code = 200
+		mock_post_response.json.return_value = {"update": [{"id": 101}]}
 
 		mock_api_instance = MagicMock()
-		mock_api_instance.put.return_value = mock_put_response
+		mock_api_instance.post.return_value = mock_post_response
 		mock_wc_api.return_value = mock_api_instance
 
 		# Call function under test
 		update_stock_levels_on_woocommerce_site("variant_item_code")
 
-		# Assert that the inventories put calls were made with the correct arguments
-		self.assertEqual(mock_api_instance.put.call_count, 1)
-		actual_put_endpoint = mock_api_instance.put.call_args.kwargs["endpoint"]
-		actual_put_data = mock_api_instance.put.call_args.kwargs["data"]
+		# Assert that the variations batch call was made with the correct arguments
+		self.assertEqual(mock_api_instance.post.call_count, 1)
+		actual_post_endpoint = mock_api_instance.post.call_args.kwargs["endpoint"]
+		actual_post_data = mock_api_instance.post.call_args.kwargs["data"]
+
+		expected_post_endpoint = "products/100/variations/batch"
+		expected_data = {"update": [{"id": 101, "stock_quantity": 15}]}
+		self.assertEqual(actual_post_endpoint, expected_post_endpoint)
+		self.assertEqual(actual_post_data, expected_data)
+
+	@patch("woocommerce_softland.tasks.stock_update.frappe")
+	@patch("woocommerce_softland.tasks.stock_update.get_api_client")
+	@patch("woocommerce_softland.tasks.stock_update.get_stock_updates")
+	def test_update_stock_levels_on_woocommerce_sites_batches_updates(
+		self, mock_get_stock_updates, mock_wc_api, mock_frappe
+	):
+		# Set up stock updates for 250 dummy items, each set to sync to the same WC site
+		mock_get_stock_updates.return_value = [
+			StockUpdate(
+				item_code=f"Item-{x}",
+				woocommerce_server="woo1.example.com",
+				woocommerce_id=x + 1,
+				parent_woocommerce_id=None,
+				stock_quantity=5,
+			)
+			for x in range(250)
+		]
+
+		# Let the update of the second item in each batch fail
+		def post_batch(endpoint, data, **kwargs):
+			mock_post_response = Mock()
+			mock_post_response.status_code = 200
+			results = [{"id": row["id"]} for row in data["update"]]
+			results[1] = {
+				"id": 0,
+				"error": {"code": "woocommerce_rest_invalid_id", "message": "Invalid ID."},
+			}
+			mock_post_response.json.return_value = {"update": results}
+			return mock_post_response
+
+		mock_api_instance = MagicMock()
+		mock_api_instance.post.side_effect = post_batch
+		mock_wc_api.return_value = mock_api_instance
+
+		# Call function under test
+		item_codes = [f"Item-{x}" for x in range(250)]
+		result = update_stock_levels_on_woocommerce_sites(item_codes)
+		mock_get_stock_updates.assert_called_once_with(item_codes)
+
+		# Assert that the updates were posted in batches of at most 100
+		self.assertFalse(result)
+		batch_sizes = [
+			len(call.kwargs["data"]["update"]) for call in mock_api_instance.post.call_args_list
+		]
+		self.assertEqual(batch_sizes, [100, 100, 50])
+
+		# Assert that each failed row was logged individually
+		self.assertEqual(mock_frappe.log_error.call_count, 3)
+		self.assertIn("Item-101", mock_frappe.log_error.call_args_list[1].args[1])
 
-		expected_put_endpoint = "products/100/variations/101"
-		expected_data = {"stock_quantity": 15}
-		self.assertEqual(actual_put_endpoint, expected_put_endpoint)
-		self.assertEqual(actual_put_data, expected_data)
+	@patch("woocommerce_softland.tasks.stock_update.frappe")
+	def test_queue_stock_updates_schedules_one_job(self, mock_frappe):
+		# The first call sets the flag, the second finds it already set
+		mock_frappe.cache.set.side_effect = [True, None]
+
+		queue_stock_updates({"Item-A", "Item-B"})
+		queue_stock_updates({"Item-A"})
 
-	@patch("woocommerce_softland.tasks.stock_update.frappe.db.get_all")
+		self.assertEqual(mock_frappe.cache.sadd.call_count, 2)
+		mock_frappe.enqueue.assert_called_once_with(
+			"woocommerce_softland.tasks.stock_update.post_queued_stock_updates"
+		)
+
+	@patch("woocommerce_softland.tasks.stock_update.sleep")
+	@patch("woocommerce_softland.tasks.stock_update.update_stock_levels_on_woocommerce_sites")
+	@patch("woocommerce_softland.tasks.stock_update.frappe")
+	def test_post_queued_stock_updates(self, mock_frappe, mock_update_stock_levels, mock_sleep):
+		mock_frappe.cache.pipeline.return_value.execute.return_value = ({b"Item-B", b"Item-A"}, 1)
+
+		post_queued_stock_updates()
+
+		# Assert that the flag was cleared and every queued item was updated once
+		mock_frappe.cache.delete_value.assert_called_once()
+		mock_update_stock_levels.assert_called_once_with(["Item-A", "Item-B"])
+
+	def test_is_stock_update_required(self):
+		last_push = add_days(now_datetime(), -2)
+		test_parameters = [
+			# Never posted before
+			(frappe._dict(woocommerce_last_stock_push=None, stock_level_refresh_interval=7), 5, True),
+			# Stock level changed since the last update
+			(stock_level_posted(4, last_push, refresh_interval=7), 5, True),
+			# Stock level unchanged, refresh interval not passed yet
+			(stock_level_posted(5, last_push, refresh_interval=7), 5, False),
+			# Stock level unchanged, refresh interval passed
+			(stock_level_posted(5, last_push, refresh_interval=1), 5, True),
+			# Stock level unchanged, always refresh
+			(stock_level_posted(5, last_push, refresh_interval=0), 5, True),
+		]
+		for stock_level, stock_quantity, expected_result in test_parameters:
+			with self.subTest(stock_level=stock_level):
+				self.assertEqual(is_stock_update_required(stock_level, stock_quantity), expected_result)
+
+	@patch("woocommerce_softland.tasks.stock_update.get_stock_updates")
 	@patch("woocommerce_softland.tasks.stock_update.frappe.enqueue")
 	def test_update_stock_levels_for_all_enabled_items_in_background(
-		self, mock_enqueue, mock_get_all
+		self, mock_enqueue, mock_get_stock_updates
 	):
 		# Set up mock return values
-		mock_get_all.side_effect = [
-			[_dict({"name": f"Item-1-{x}"}) for x in range(500)],  # First page of results
-			[_dict({"name": f"Item-2-{x}"}) for x in range(500)],  # Second page of results
-			[],  # No more results, loop should exit
+		stock_updates = [
+			StockUpdate(
+				item_code=f"Item-{x}",
+				woocommerce_server="woo1.example.com",
+				woocommerce_id=x + 1,
+				parent_woocommerce_id=None,
+				stock_quantity=5,
+			)
+			for x in range(2500)
 		]
+		mock_get_stock_updates.return_value = stock_updates
 
 		# Call the function
 		update_stock_levels_for_all_enabled_items_in_background()
 
-		# Assertions to check if get_all was called correctly
-		self.assertEqual(mock_get_all.call_count, 3)
-		expected_calls = [
-			call(doctype="Item", filters={"disabled": 0}, fields=["name"], start=0, page_length=500),
-			call(doctype="Item", filters={"disabled": 0}, fields=["name"], start=500, page_length=500),
-			call(doctype="Item", filters={"disabled": 0}, fields=["name"], start=1000, page_length=500),
-		]
-		mock_get_all.assert_has_calls(expected_calls, any_order=True)
+		# Assertions to check if the stock levels of all items were retrieved in one go
+		mock_get_stock_updates.assert_called_once_with()
 
 		# Assertions to check if enqueue was called correctly
-		# This assumes we have 1000 items, based on the pagination logic above.
-		self.assertEqual(mock_enqueue.call_count, 1000)
+		# This assumes we have 2500 stock updates, posted in jobs of 1000 updates each.
+		self.assertEqual(mock_enqueue.call_count, 3)
 		mock_enqueue.assert_called_with(
-			"woocommerce_softland.tasks.stock_update.update_stock_levels_on_woocommerce_site",
-			item_code="Item-2-499",  # Here we'd check for the last `item_code` being passed.
+			"woocommerce_softland.tasks.stock_update.post_stock_updates",
+			queue="long",
+			stock_updates=stock_updates[2000:],
 		)
+
+
+def stock_level_posted(stock_quantity, posted_at, refresh_interval):
+	"""
+	Returns a dummy stock level row as returned by get_stock_updates' query
+	"""
+	return frappe._dict(
+		woocommerce_last_stock_qty=stock_quantity,
+		woocommerce_last_stock_push=posted_at,
+		stock_level_refresh_interval=refresh_interval,
+	)
@@ -5,7 +5,13 @@ import frappe
 from erpnext import get_default_company
 from frappe.tests.utils import FrappeTestCase
 
-from woocommerce_softland.tasks.sync_sales_orders import SynchroniseSalesOrder
+from woocommerce_softland.tasks.sync_sales_orders import (
+	SynchroniseSalesOrder,
+	get_customer_sync_hash,
+)
+from woocommerce_softland.woocommerce.doctype.woocommerce_product.woocommerce_product import (
+	WooCommerceProduct,
+)
 from woocommerce_softland.woocommerce.woocommerce_api import (
 	generate_woocommerce_record_name_from_domain_and_id,
 )
@@ -422,6 +428,218 @@ class TestWooCommerceSync(FrappeTestCase):
 		self.assertIsNone(mock_sales_order.woocommerce_payment_entry)
 		mock_frappe_new_doc.assert_not_called()
 
+	@patch("woocommerce_softland.tasks.sync_sales_orders.get_linked_items")
+	def test_line_items_are_resolved_with_a_single_query(
+		self, mock_get_linked_items, mock_get_wc_servers
+	):
+		"""
+		Test that the Items of all WooCommerce Order line items are retrieved at once
+		"""
+		# Initialise class
+		sync = SynchroniseSalesOrder()
+
+		# Arrange
+		line_items = [
+			{"product_id": 1, "variation_id": 0, "quantity": 2, "price": 10},
+			{"product_id": 2, "variation_id": 12, "quantity": 1, "price": 5},
+			{"product_id": 1, "variation_id": 0, "quantity": 1, "price": 10},
+		]
+		wc_order = frappe._dict(
+			line_items=json.dumps(line_items), shipping_tax=0, shipping_total=0, total=35
+		)
+
+		sales_order = Mock(
+			woocommerce_server="example.com",
+			delivery_date="2024-01-10",
+			shipping_rule=None,
+			items=[],
+			taxes=[],
+		)
+		sales_order.append.side_effect = lambda table, row: getattr(sales_order, table).append(row)
+
+		mock_get_wc_servers.return_value = frappe._dict(
+			warehouse="Stores - SC", enable_tax_lines_sync=0, order_line_item_field_map=[]
+		)
+		mock_get_linked_items.return_value = [
+			frappe._dict(item_code="ITEM-1", item_name="Item 1", woocommerce_id="1"),
+			frappe._dict(item_code="ITEM-2", item_name="Item 2", woocommerce_id="12"),
+		]
+
+		# Act
+		sync.set_items_in_sales_order(sales_order, wc_order)
+
+		# Assert
+		mock_get_linked_items.assert_called_once_with(
+			"example.com", woocommerce_ids=[1, 12, 1], exclude_disabled_items=True
+		)
+		self.assertEqual(
+			[item["item_code"] for item in sales_order.items], ["ITEM-1", "ITEM-2", "ITEM-1"]
+		)
+
+	@patch("woocommerce_softland.tasks.sync_sales_orders.get_linked_items")
+	def test_taxes_are_applied_once_for_a_200_line_order(
+		self, mock_get_linked_items, mock_get_wc_servers
+	):
+		"""
+		Test that a Sales Taxes and Charges Template is applied once for an order with many lines,
+		before the shipping tax rows are added
+		"""
+		# Initialise class
+		sync = SynchroniseSalesOrder()
+
+		# Arrange
+		line_items = [
+			{
+				"product_id": product_id,
+				"variation_id": 0,
+				"quantity": 1,
+				"price": 10,
+				"subtotal": "10",
+				"subtotal_tax": "1.5",
+			}
+			for product_id in range(1, 201)
+		]
+		wc_order = frappe._dict(
+			line_items=json.dumps(line_items), shipping_tax=1.5, shipping_total=10, total=2311.5
+		)
+
+		sales_order = Mock(
+			woocommerce_server="example.com",
+			delivery_date="2024-01-10",
+			shipping_rule=None,
+			items=[],
+			taxes=[],
+		)
+		sales_order.append.side_effect = lambda table, row: getattr(sales_order, table).append(row)
+		sales_order.set_missing_lead_customer_details.side_effect = lambda: sales_order.taxes.append(
+			{"charge_type": "On Net Total"}
+		)
+
+		mock_get_wc_servers.return_value = frappe._dict(
+			warehouse="Stores - SC",
+			enable_tax_lines_sync=1,
+			use_actual_tax_type=0,
+			sales_taxes_and_charges_template="VAT 15%",
+			taxes=[frappe._dict(included_in_print_rate=1)],
+			order_line_item_field_map=[],
+		)
+		mock_get_linked_items.return_value = [
+			frappe._dict(item_code=f"ITEM-{product_id}", item_name="Item", woocommerce_id=str(product_id))
+			for product_id in range(1, 201)
+		]
+
+		# Act
+		sync.set_items_in_sales_order(sales_order, wc_order)
+
+		# Assert
+		self.assertEqual(len(sales_order.items), 200)
+		self.assertEqual(sales_order.items[0]["rate"], 11.5)
+		sales_order.set_missing_lead_customer_details.assert_called_once()
+		self.assertEqual(
+			[tax.get("description") or tax["charge_type"] for tax in sales_order.taxes],
+			["On Net Total", "Shipping Tax", "Shipping Total"],
+		)
+
+	@patch("woocommerce_softland.tasks.sync_sales_orders.run_item_sync")
+	@patch.object(WooCommerceProduct, "iter_records")
+	@patch("woocommerce_softland.tasks.sync_sales_orders.get_linked_items")
+	def test_only_products_that_are_not_linked_are_retrieved(
+		self, mock_get_linked_items, mock_iter_records, mock_run_item_sync, mock_get_wc_servers
+	):
+		"""
+		Test that products that are already linked to an Item are not retrieved when creating a
+		Sales Order, and that missing products are retrieved per parent product
+		"""
+		# Initialise class
+		sync = SynchroniseSalesOrder()
+
+		# Arrange
+		line_items = [
+			{"product_id": 1, "variation_id": 0},
+			{"product_id": 2, "variation_id": 0},
+			{"product_id": 3, "variation_id": 31, "parent_name": "Hoodie"},
+			{"product_id": 3, "variation_id": 32, "parent_name": "Hoodie"},
+			{"product_id": 4, "variation_id": 0},
+			{"product_id": 0, "variation_id": 0},
+		]
+		mock_get_linked_items.return_value = [
+			frappe._dict(item_code="ITEM-1", item_name="Item 1", woocommerce_id="1", link_enabled=1),
+			frappe._dict(item_code="ITEM-4", item_name="Item 4", woocommerce_id="4", link_enabled=0),
+		]
+		mock_iter_records.side_effect = lambda **kwargs: [
+			f"{kwargs['endpoint']}/{product_id}" for product_id in kwargs["filters"][0][3]
+		]
+
+		# Act
+		sync.create_missing_items(frappe._dict(), line_items, "example.com")
+
+		# Assert
+		self.assertEqual(mock_iter_records.call_count, 2)
+		self.assertEqual(
+			[call.kwargs["woocommerce_product"] for call in mock_run_item_sync.call_args_list],
+			["products/2", "products/4", "products/3/variations/31", "products/3/variations/32"],
+		)
+		self.assertEqual(
+			mock_iter_records.call_args_list[1].kwargs["metadata"], {"parent_woocommerce_name": "Hoodie"}
+		)
+
+	@patch("woocommerce_softland.tasks.sync_sales_orders.create_contact")
+	@patch.object(SynchroniseSalesOrder, "create_or_update_address")
+	@patch("woocommerce_softland.tasks.sync_sales_orders.frappe.get_doc")
+	def test_unchanged_customer_is_not_saved(
+		self, mock_get_doc, mock_create_or_update_address, mock_create_contact, mock_get_wc_servers
+	):
+		"""
+		Test that a returning customer whose details have not changed is linked without updating
+		the Customer, its Addresses or its Contact
+		"""
+		# Initialise class
+		sync = SynchroniseSalesOrder()
+
+		# Arrange
+		address = {
+			"first_name": "Samwise",
+			"last_name": "Gangee",
+			"company": "",
+			"address_1": "Ring Lane",
+			"address_2": "",
+			"city": "Shire",
+			"state": "ME",
+			"postcode": "12121",
+			"country": "DE",
+			"email": "samwise@me.net",
+			"phone": "0123323216",
+		}
+		wc_order = frappe._dict(
+			id=1,
+			customer_id=5,
+			woocommerce_server="example.com",
+			billing=json.dumps(address),
+			shipping=json.dumps(address),
+		)
+		mock_get_wc_servers.return_value = frappe._dict(enable_dual_accounts=0)
+
+		# Whitespace differences do not change the hash
+		sync_hash = get_customer_sync_hash("samwise@me.net", {**address, "city": " Shire "}, address)
+
+		# Act
+		with patch.object(
+			frappe.db,
+			"get_value",
+			return_value=frappe._dict(name="Samwise Gangee", custom_woocommerce_sync_hash=sync_hash),
+		) as mock_get_value:
+			customer_name = sync.create_or_link_customer_and_address(wc_order)
+
+		# Assert
+		self.assertEqual(customer_name, "Samwise Gangee")
+		mock_get_value.assert_called_once()
+		mock_get_doc.assert_not_called()
+		mock_create_or_update_address.assert_not_called()
+		mock_create_contact.assert_not_called()
+		self.assertNotEqual(
+			sync_hash, get_customer_sync_hash("samwise@me.net", {**address, "city": "Bree"}, address)
+		)
+
 
 def create_bank_account(
 	bank_name=default_bank, account_name="_Test Bank", company=default_company
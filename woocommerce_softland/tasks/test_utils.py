@@ -1,10 +1,22 @@
 import unittest
 from unittest.mock import Mock, patch
 
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from woocommerce_softland.exceptions import CircuitOpenError
 from woocommerce_softland.tasks.utils import (  # Adjust the import according to your project structure
+	CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+	REQUEST_LOG_BUFFER_KEY,
+	REQUEST_LOG_FLUSH_THRESHOLD,
+	APIWithRequestLogging,
+	buffer_woocommerce_request_log,
+	flush_woocommerce_request_logs,
+	get_retry_after,
+	is_circuit_open,
 	log_woocommerce_request,
+	pack_request_log_body,
+	unpack_request_log_body,
 )
 
 
@@ -13,8 +25,8 @@ class TestLogWooCommerceRequest(FrappeTestCase):
 	def setUpClass(cls):
 		super().setUpClass()  # important to call super() methods when extending TestCase.
 
-	@patch("woocommerce_softland.tasks.utils.frappe")  # Mock frappe
-	def test_successful_request(self, mock_frappe):
+	@patch("woocommerce_softland.tasks.utils.buffer_woocommerce_request_log")
+	def test_successful_request(self, mock_buffer):
 		# Setup
 		mock_response = Mock()
 		mock_response.status_code = 200
@@ -26,10 +38,61 @@ class TestLogWooCommerceRequest(FrappeTestCase):
 		)
 
 		# Assert
-		self.assertEqual(mock_frappe.get_doc.call_count, 1)
-		logged_request = mock_frappe.get_doc.call_args[0][0]
+		self.assertEqual(mock_buffer.call_count, 1)
+		logged_request = mock_buffer.call_args[0][0]
 		self.assertEqual(logged_request["status"], "Success")
 
+	@patch("woocommerce_softland.tasks.utils.frappe.db.commit")
+	@patch("woocommerce_softland.tasks.utils.insert_woocommerce_request_logs")
+	def test_buffered_requests_are_flushed_in_bulk(self, mock_insert, mock_commit):
+		"""
+		Test that buffered request logs schedule a flush once the buffer is full, and are inserted in batches
+		"""
+		frappe.cache.delete(frappe.cache.make_key(REQUEST_LOG_BUFFER_KEY))
+
+		with patch("woocommerce_softland.tasks.utils.frappe.enqueue") as mock_enqueue:
+			for i in range(REQUEST_LOG_FLUSH_THRESHOLD + 1):
+				buffer_woocommerce_request_log({"endpoint": f"orders/{i}", "status": "Success"})
+		mock_enqueue.assert_called_once()
+
+		flush_woocommerce_request_logs()
+
+		self.assertEqual(mock_insert.call_count, 2)
+		first_batch, second_batch = (c.args[0] for c in mock_insert.call_args_list)
+		self.assertEqual(len(first_batch), REQUEST_LOG_FLUSH_THRESHOLD)
+		self.assertEqual(first_batch[0]["endpoint"], "orders/0")
+		self.assertEqual(second_batch[0]["endpoint"], f"orders/{REQUEST_LOG_FLUSH_THRESHOLD}")
+		self.assertIn("creation", second_batch[0])
+
+	def test_large_bodies_are_truncated_and_compressed(self):
+		body = "x" * 10000
+		packed = pack_request_log_body(body, max_body_size=4000)
+		self.assertLess(len(packed), 1000)
+		self.assertEqual(
+			unpack_request_log_body(packed), "x" * 4000 + "\n[... truncated 6000 characters]"
+		)
+
+		# Small bodies are stored as is
+		self.assertEqual(pack_request_log_body('{"id": 1}'), '{"id": 1}')
+		self.assertEqual(unpack_request_log_body('{"id": 1}'), '{"id": 1}')
+
+	@patch("woocommerce_softland.tasks.utils.buffer_woocommerce_request_log")
+	def test_errors_only_log_mode(self, mock_buffer):
+		api = APIWithRequestLogging(
+			url="http://foo",
+			consumer_key="ck",
+			consumer_secret="cs",
+			log_requests=True,
+			log_mode="Errors Only",
+		)
+		with patch.dict(frappe.flags, {"in_test": False}):
+			api.log_request("GET", "products", None, None, mock_response(200), 0)
+			mock_buffer.assert_not_called()
+
+			api.log_request("GET", "products", None, None, mock_response(404), 0)
+			mock_buffer.assert_called_once()
+			self.assertEqual(mock_buffer.call_args.args[0]["status"], "Error")
+
 	# @patch('woocommerce_softland.tasks.utils.frappe')
 	# def test_error_request(self, mock_frappe):
 	# 	# Similar structure as above, but simulate an error response (e.g., status_code != 200)
@@ -37,3 +100,127 @@ class TestLogWooCommerceRequest(FrappeTestCase):
 	# @patch('woocommerce_softland.tasks.utils.frappe')
 	# def test_no_response(self, mock_frappe):
 	# 	# Test the function when res is None
+
+
+class TestAPIRateLimit(FrappeTestCase):
+	@patch("woocommerce_softland.tasks.utils.sleep")
+	def test_requests_wait_when_bucket_is_empty(self, mock_sleep):
+		api = APIWithRequestLogging(
+			url="http://ratelimit.example.com",
+			consumer_key="ck",
+			consumer_secret="cs",
+			rate_limit=0.1,
+			rate_limit_burst=2,
+			woocommerce_server=frappe.generate_hash(),
+		)
+
+		# The first two requests use the burst, the third has to wait for the bucket to refill
+		mock_sleep.side_effect = StopIteration
+		api.wait_for_rate_limit()
+		api.wait_for_rate_limit()
+		mock_sleep.assert_not_called()
+
+		with self.assertRaises(StopIteration):
+			api.wait_for_rate_limit()
+		self.assertAlmostEqual(mock_sleep.call_args.args[0], 10, delta=1)
+
+	def test_no_rate_limit(self):
+		api = APIWithRequestLogging(url="http://foo", consumer_key="ck", consumer_secret="cs")
+		disabled_api = APIWithRequestLogging(
+			url="http://foo", consumer_key="ck", consumer_secret="cs", rate_limit=0
+		)
+		with patch("woocommerce_softland.tasks.utils.frappe") as mock_frappe:
+			api.wait_for_rate_limit()
+			disabled_api.wait_for_rate_limit()
+		mock_frappe.cache.register_script.assert_not_called()
+
+
+@patch("woocommerce_softland.tasks.utils.sleep")
+class TestAPIRetries(FrappeTestCase):
+	def setUp(self):
+		self.api = APIWithRequestLogging(url="http://foo", consumer_key="ck", consumer_secret="cs")
+
+	def test_get_is_retried_after_retry_after_seconds(self, mock_sleep):
+		responses = [mock_response(503, {"Retry-After": "2"}), mock_response(200)]
+		with patch.object(self.api, "_send_request", side_effect=responses) as mock_send_request:
+			response = self.api.get("products")
+
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(mock_send_request.call_count, 2)
+		mock_sleep.assert_called_once_with(2.0)
+
+	def test_get_gives_up_after_max_retries(self, mock_sleep):
+		with patch.object(
+			self.api, "_send_request", return_value=mock_response(503)
+		) as mock_send_request:
+			response = self.api.get("products")
+
+		self.assertEqual(response.status_code, 503)
+		self.assertEqual(mock_send_request.call_count, self.api.max_retries + 1)
+
+		# Backoff delays are random but never exceed the exponential limit
+		for retries, call in enumerate(mock_sleep.call_args_list):
+			self.assertLessEqual(call.args[0], 2**retries)
+
+	def test_post_is_only_retried_when_safe(self, mock_sleep):
+		test_parameters = [
+			# WooCommerce may have processed the request
+			(mock_response(503), {}, 1),
+			# WooCommerce rejected the request without processing it
+			(mock_response(429), {}, 2),
+			# The caller marked the request as safe to repeat
+			(mock_response(503), {"idempotent": True}, 2),
+		]
+		for first_response, kwargs, expected_call_count in test_parameters:
+			with self.subTest(status_code=first_response.status_code, kwargs=kwargs):
+				with patch.object(
+					self.api, "_send_request", side_effect=[first_response, mock_response(201)]
+				) as mock_send_request:
+					self.api.post("products", {"name": "foo"}, **kwargs)
+
+				self.assertEqual(mock_send_request.call_count, expected_call_count)
+				self.assertNotIn("idempotent", mock_send_request.call_args.kwargs)
+
+	def test_get_retry_after(self, mock_sleep):
+		self.assertEqual(get_retry_after(mock_response(429, {"Retry-After": "5"})), 5.0)
+		self.assertEqual(
+			get_retry_after(mock_response(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})), 0.0
+		)
+		self.assertIsNone(get_retry_after(mock_response(429)))
+
+
+@patch("woocommerce_softland.tasks.utils.sleep")
+class TestAPICircuitBreaker(FrappeTestCase):
+	def setUp(self):
+		self.api = APIWithRequestLogging(
+			url="http://foo",
+			consumer_key="ck",
+			consumer_secret="cs",
+			woocommerce_server=frappe.generate_hash(),
+			max_retries=0,
+		)
+
+	def test_circuit_opens_after_repeated_failures_and_closes_on_success(self, mock_sleep):
+		with patch.object(
+			self.api, "_send_request", return_value=mock_response(503)
+		) as mock_send_request:
+			for _ in range(CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+				self.api.get("products")
+			self.assertTrue(is_circuit_open(self.api.woocommerce_server))
+
+			# Requests fail fast while the circuit is open
+			with self.assertRaises(CircuitOpenError):
+				self.api.get("products")
+			self.assertEqual(mock_send_request.call_count, CIRCUIT_BREAKER_FAILURE_THRESHOLD)
+
+		# A successful probe closes the circuit
+		with patch.object(self.api, "_send_request", return_value=mock_response(200)):
+			self.api.get("products", ignore_circuit_breaker=True)
+		self.assertFalse(is_circuit_open(self.api.woocommerce_server))
+
+
+def mock_response(status_code, headers=None):
+	response = Mock()
+	response.status_code = status_code
+	response.headers = headers or {}
+	return response
@@ -0,0 +1,164 @@
+import json
+from copy import deepcopy
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from woocommerce_softland.tasks.webhooks import (
+	REQUIRED_ORDER_ATTRIBUTES,
+	REQUIRED_PRODUCT_ATTRIBUTES,
+	WEBHOOK_PAYLOAD_MAX_AGE,
+	coalesce_webhook_deliveries,
+	get_woocommerce_record_from_webhook_delivery,
+	process_webhook_delivery,
+	set_woocommerce_ids_of_webhook_deliveries,
+)
+from woocommerce_softland.woocommerce.doctype.woocommerce_order.test_woocommerce_order import (
+	dummy_wc_order,
+)
+from woocommerce_softland.woocommerce.doctype.woocommerce_order.woocommerce_order import (
+	WooCommerceOrder,
+)
+from woocommerce_softland.woocommerce.doctype.woocommerce_product.woocommerce_product import (
+	WooCommerceProduct,
+)
+
+
+@patch(
+	"woocommerce_softland.tasks.webhooks.frappe.get_cached_doc",
+	return_value=frappe._dict(woocommerce_server_url="https://woo.example.com"),
+)
+@patch.object(WooCommerceOrder, "load_from_db")
+class TestWebhooks(FrappeTestCase):
+	def get_delivery(self, payload, age=0, topic="order.created"):
+		return frappe._dict(
+			woocommerce_server="woo.example.com",
+			topic=topic,
+			woocommerce_id=str(payload["id"]),
+			payload=json.dumps(payload),
+			creation=now_datetime() - timedelta(seconds=age),
+		)
+
+	def test_order_is_built_from_payload(self, mock_load_from_db, mock_get_cached_doc):
+		delivery = self.get_delivery(deepcopy(dummy_wc_order))
+
+		wc_order = get_woocommerce_record_from_webhook_delivery(
+			delivery, WooCommerceOrder, REQUIRED_ORDER_ATTRIBUTES
+		)
+
+		mock_load_from_db.assert_not_called()
+		self.assertEqual(wc_order.name, f"woo.example.com~{dummy_wc_order['id']}")
+		self.assertEqual(json.loads(wc_order.line_items), dummy_wc_order["line_items"])
+
+	def test_order_is_retrieved_if_payload_is_stale_or_incomplete(
+		self, mock_load_from_db, mock_get_cached_doc
+	):
+		stale_delivery = self.get_delivery(deepcopy(dummy_wc_order), age=WEBHOOK_PAYLOAD_MAX_AGE + 1)
+		get_woocommerce_record_from_webhook_delivery(
+			stale_delivery, WooCommerceOrder, REQUIRED_ORDER_ATTRIBUTES
+		)
+		self.assertEqual(mock_load_from_db.call_count, 1)
+
+		incomplete_payload = deepcopy(dummy_wc_order)
+		incomplete_payload.pop("line_items")
+		get_woocommerce_record_from_webhook_delivery(
+			self.get_delivery(incomplete_payload), WooCommerceOrder, REQUIRED_ORDER_ATTRIBUTES
+		)
+		self.assertEqual(mock_load_from_db.call_count, 2)
+
+	@patch.object(WooCommerceProduct, "load_from_db")
+	def test_product_is_built_from_payload_unless_incomplete(
+		self, mock_product_load_from_db, mock_load_from_db, mock_get_cached_doc
+	):
+		product = {
+			"id": 42,
+			"parent_id": 0,
+			"type": "simple",
+			"name": "Hoodie",
+			"sku": "HOODIE",
+			"regular_price": "45",
+			"attributes": [],
+			"images": [],
+			"date_created": "2024-01-01T10:00:00",
+			"date_created_gmt": "2024-01-01T08:00:00",
+			"date_modified": "2024-01-02T10:00:00",
+			"date_modified_gmt": "2024-01-02T08:00:00",
+		}
+		wc_product = get_woocommerce_record_from_webhook_delivery(
+			self.get_delivery(product, topic="product.updated"),
+			WooCommerceProduct,
+			REQUIRED_PRODUCT_ATTRIBUTES,
+		)
+		mock_product_load_from_db.assert_not_called()
+		self.assertEqual(wc_product.woocommerce_name, "Hoodie")
+		self.assertEqual(wc_product.woocommerce_id, 42)
+
+		get_woocommerce_record_from_webhook_delivery(
+			self.get_delivery({"id": 42}, topic="product.updated"),
+			WooCommerceProduct,
+			REQUIRED_PRODUCT_ATTRIBUTES,
+		)
+		mock_product_load_from_db.assert_called_once()
+
+	def test_only_newest_delivery_of_a_record_is_processed(
+		self, mock_load_from_db, mock_get_cached_doc
+	):
+		deliveries = [
+			frappe._dict(name=name, woocommerce_server=server, topic=topic, woocommerce_id=woocommerce_id)
+			for name, server, topic, woocommerce_id in (
+				("d1", "woo.example.com", "order.created", "1"),
+				("d2", "woo.example.com", "order.updated", "1"),
+				("d3", "woo.example.com", "product.updated", "1"),
+				("d4", "other.example.com", "order.updated", "1"),
+				("d5", "woo.example.com", "order.updated", "1"),
+			)
+		]
+
+		newest_deliveries, superseded_deliveries = coalesce_webhook_deliveries(deliveries)
+
+		self.assertEqual([delivery.name for delivery in newest_deliveries], ["d3", "d4", "d5"])
+		self.assertEqual([delivery.name for delivery in superseded_deliveries], ["d1", "d2"])
+
+	def test_woocommerce_ids_are_set_from_raw_payloads(self, mock_load_from_db, mock_get_cached_doc):
+		deliveries = [
+			frappe._dict(name="d1", woocommerce_id=None, payload=json.dumps({"id": 7})),
+			frappe._dict(name="d2", woocommerce_id=None, payload="webhook_id=3"),
+			frappe._dict(name="d3", woocommerce_id="8", payload=json.dumps({"id": 8})),
+		]
+
+		with patch.object(frappe.db, "set_value") as mock_set_value:
+			parsed_deliveries = set_woocommerce_ids_of_webhook_deliveries(deliveries)
+
+		self.assertEqual([delivery.woocommerce_id for delivery in parsed_deliveries], ["7", "8"])
+		self.assertEqual(mock_set_value.call_count, 2)
+		self.assertEqual(mock_set_value.call_args_list[1].args[1], "d2")
+		self.assertEqual(mock_set_value.call_args_list[1].args[2]["status"], "Failed")
+
+	@patch("woocommerce_softland.tasks.webhooks.frappe.get_doc")
+	@patch("woocommerce_softland.tasks.webhooks.run_item_sync")
+	def test_deleted_unlinked_product_is_not_synchronised(
+		self, mock_run_item_sync, mock_get_doc, mock_load_from_db, mock_get_cached_doc
+	):
+		"""
+		Test that a deleted product is never passed to the synchronisation, so no Item is created for it
+		"""
+		delivery = self.get_delivery({"id": 42}, topic="product.deleted")
+		delivery.update(status="Queued", save=Mock())
+		mock_get_doc.return_value = delivery
+
+		with patch.object(frappe.db, "set_value") as mock_set_value:
+			process_webhook_delivery("d1")
+
+		mock_run_item_sync.assert_not_called()
+		mock_load_from_db.assert_not_called()
+		mock_set_value.assert_called_once_with(
+			"Item WooCommerce Server",
+			{"woocommerce_server": "woo.example.com", "woocommerce_id": "42"},
+			"enabled",
+			0,
+		)
+		self.assertEqual(delivery.status, "Processed")
+		delivery.save.assert_called_once()
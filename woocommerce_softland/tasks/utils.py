@@ -1,45 +1,414 @@
+import base64
+import json
+import random
 import traceback
+import zlib
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import sleep
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlencode
 
 import frappe
 import requests
+from frappe.utils import now_datetime
 from frappe.utils.caching import redis_cache
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
 from woocommerce import API
 
+from woocommerce_softland.exceptions import CircuitOpenError
+
+# Requests are retried when WooCommerce is rate limiting or temporarily unavailable
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+# Methods that can be sent again without side effects. POST requests are only retried if the
+# caller marks them as idempotent, or if WooCommerce rejected them without processing them.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+DEFAULT_MAX_RETRIES = 3
+# Exponential backoff in seconds: a random delay of up to 1, 2, 4... seconds, but no more than 30
+RETRY_BACKOFF_BASE = 1
+RETRY_BACKOFF_MAX = 30
+# Don't wait if the server asks to retry after more than this many seconds
+RETRY_AFTER_MAX = 60
+
+# Stop sending requests to a WooCommerce Server after this many failed requests within the window
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = 5
+CIRCUIT_BREAKER_FAILURE_WINDOW = 120
+# While the circuit is open, requests fail immediately. A scheduled probe closes the circuit as soon
+# as the WooCommerce Server responds again, otherwise it closes after this many seconds.
+CIRCUIT_BREAKER_OPEN_SECONDS = 900
+
+# Request logs are buffered in a Redis list and inserted in bulk, as soon as the buffer holds this
+# many logs or otherwise every minute
+REQUEST_LOG_BUFFER_KEY = "woocommerce_request_log_buffer"
+REQUEST_LOG_FLUSH_THRESHOLD = 500
+REQUEST_LOG_FIELDS = (
+	"user",
+	"url",
+	"endpoint",
+	"method",
+	"params",
+	"data",
+	"response",
+	"error",
+	"status",
+	"time_elapsed",
+	"retries",
+)
+
+# Logging modes on WooCommerce Server. Failed requests are always logged.
+REQUEST_LOG_MODE_ALL = "All Requests"
+REQUEST_LOG_MODE_ERRORS_ONLY = "Errors Only"
+REQUEST_LOG_MODE_SAMPLED = "Sampled"
+# Logged bodies longer than this many characters are truncated, and bodies of at least
+# REQUEST_LOG_COMPRESS_MIN_SIZE characters are stored zlib compressed
+REQUEST_LOG_MAX_BODY_SIZE = 64 * 1024
+REQUEST_LOG_COMPRESS_MIN_SIZE = 1024
+COMPRESSED_BODY_PREFIX = "zlib+base64:"
+
+# Token bucket shared by all workers, stored in a Redis hash. Refills at ARGV[1] tokens per second
+# up to ARGV[2] tokens. Takes a token if one is available and returns 0, otherwise returns the
+# number of seconds to wait for the next token. Returned as a string since Redis truncates numbers.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "timestamp")
+local tokens = tonumber(bucket[1]) or burst
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - timestamp) * rate)
+
+local wait = 0
+if tokens >= 1 then
+	tokens = tokens - 1
+else
+	wait = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "timestamp", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
 
 class APIWithRequestLogging(API):
 	"""WooCommerce API with Request Logging."""
 
+	def __init__(self, url, consumer_key, consumer_secret, **kwargs):
+		super().__init__(url, consumer_key, consumer_secret, **kwargs)
+
+		# When a pool size is given, keep connections to the WooCommerce server alive in a Session
+		# instead of opening a new TCP/TLS connection for every request
+		pool_size: Optional[int] = kwargs.get("pool_size", None)
+		self.session = get_keep_alive_session(pool_size) if pool_size else None
+
+		# When the WooCommerce Server is given, failed requests are counted by its circuit breaker
+		self.woocommerce_server: Optional[str] = kwargs.get("woocommerce_server", None)
+
+		# When a rate limit is given, requests wait for a token from a bucket shared by all workers
+		self.rate_limit: Optional[float] = kwargs.get("rate_limit", None)
+		self.rate_limit_burst: int = max(1, kwargs.get("rate_limit_burst", None) or 1)
+		self.rate_limit_key: str = f"woocommerce_api_rate_limit|{self.woocommerce_server or url}"
+		self._token_bucket = None
+
+		self.max_retries: int = kwargs.get("max_retries", DEFAULT_MAX_RETRIES)
+
+		# If not given, whether requests are logged is looked up from the WooCommerce Server's settings
+		self.log_requests: Optional[bool] = kwargs.get("log_requests", None)
+		self.log_request_stack: bool = kwargs.get("log_request_stack", False)
+		self.log_mode: str = kwargs.get("log_mode", None) or REQUEST_LOG_MODE_ALL
+		self.log_sample_rate: float = kwargs.get("log_sample_rate", None) or 0
+		self.log_max_body_size: int = kwargs.get("log_max_body_size", REQUEST_LOG_MAX_BODY_SIZE)
+
+	def close(self):
+		"""
+		Close any pooled connections held by this client
+		"""
+		if self.session:
+			self.session.close()
+
 	def _API__request(self, method, endpoint, data, params=None, **kwargs):
-		"""Override _request method to also create a 'WooCommerce Request Log'"""
+		"""
+		Override _request method to retry failed requests and to also create a 'WooCommerce Request Log'
+
+		Pass idempotent=True to allow a POST request to be retried, and ignore_circuit_breaker=True to
+		send a request while the WooCommerce Server's circuit breaker is open
+		"""
+		idempotent = kwargs.pop("idempotent", method.upper() in IDEMPOTENT_METHODS)
+		ignore_circuit_breaker = kwargs.pop("ignore_circuit_breaker", False)
+
+		# Fail fast if the WooCommerce Server is down
+		if self.woocommerce_server and not ignore_circuit_breaker:
+			if is_circuit_open(self.woocommerce_server):
+				raise CircuitOpenError(
+					f"WooCommerce Server {self.woocommerce_server} is not responding, requests are paused"
+				)
+
 		result = None
+		retries = 0
 		try:
-			result = super()._API__request(method, endpoint, data, params, **kwargs)
-			if not frappe.flags.in_test and is_woocommerce_request_logging_enabled(self.url):
-				frappe.enqueue(
-					"woocommerce_softland.tasks.utils.log_woocommerce_request",
-					url=self.url,
-					endpoint=endpoint,
-					request_method=method,
-					params=params,
-					data=data,
-					res=result,
-					traceback="".join(traceback.format_stack(limit=8)),
-				)
+			while True:
+				self.wait_for_rate_limit()
+				try:
+					result = self._send_request(method, endpoint, data, params, **kwargs)
+					delay = (
+						get_retry_delay(retries, result)
+						if retries < self.max_retries and is_retryable_response(result, idempotent)
+						else None
+					)
+				except requests.exceptions.RequestException as err:
+					if retries >= self.max_retries or not is_retryable_exception(err, idempotent):
+						raise
+					delay = get_retry_delay(retries)
+
+				if delay is None:
+					break
+				retries += 1
+				sleep(delay)
+
+			if self.woocommerce_server:
+				if getattr(result, "status_code", 200) >= 500:
+					record_request_failure(self.woocommerce_server)
+				else:
+					record_request_success(self.woocommerce_server)
+
+			self.log_request(method, endpoint, params, data, result, retries)
 			return result
 		except Exception as e:
-			if not frappe.flags.in_test and is_woocommerce_request_logging_enabled(self.url):
-				frappe.enqueue(
-					"woocommerce_softland.tasks.utils.log_woocommerce_request",
-					url=self.url,
-					endpoint=endpoint,
-					request_method=method,
-					params=params,
-					data=data,
-					res=result,
-					traceback="".join(traceback.format_stack(limit=8)),
-				)
+			if self.woocommerce_server and isinstance(e, requests.exceptions.RequestException):
+				record_request_failure(self.woocommerce_server)
+			self.log_request(
+				method, endpoint, params, data, result, retries, error=frappe.get_traceback()
+			)
 			raise e
 
+	def log_request(self, method, endpoint, params, data, result, retries, error=None):
+		"""
+		Add a 'WooCommerce Request Log' to the buffer if request logging is enabled.
+
+		Failed requests are always logged, successful requests depend on the logging mode
+		"""
+		if frappe.flags.in_test:
+			return
+
+		log_requests = (
+			self.log_requests
+			if self.log_requests is not None
+			else is_woocommerce_request_logging_enabled(self.url)
+		)
+		if not log_requests:
+			return
+
+		failed = error is not None or result is None or result.status_code not in [200, 201]
+		if not failed:
+			if self.log_mode == REQUEST_LOG_MODE_ERRORS_ONLY:
+				return
+			if self.log_mode == REQUEST_LOG_MODE_SAMPLED and random.random() * 100 >= self.log_sample_rate:
+				return
+
+		stack = "".join(traceback.format_stack(limit=8)) if self.log_request_stack else None
+		buffer_woocommerce_request_log(
+			get_request_log_values(
+				url=self.url,
+				endpoint=endpoint,
+				request_method=method,
+				params=params,
+				data=data,
+				res=result,
+				error="\n\n".join(filter(None, [error, stack])) or None,
+				retries=retries,
+				max_body_size=self.log_max_body_size,
+			)
+		)
+
+	def _send_request(self, method, endpoint, data, params=None, **kwargs):
+		"""
+		Send a single request, through this client's keep-alive Session if it has one
+		"""
+		if self.session:
+			return self._session_request(method, endpoint, data, params, **kwargs)
+		return super()._API__request(method, endpoint, data, params, **kwargs)
+
+	def wait_for_rate_limit(self):
+		"""
+		Block until the rate limit of the WooCommerce server allows another request. A rate limit of
+		0 disables rate limiting
+		"""
+		if not self.rate_limit or self.rate_limit <= 0:
+			return
+
+		if not self._token_bucket:
+			self._token_bucket = frappe.cache.register_script(TOKEN_BUCKET_SCRIPT)
+
+		while True:
+			wait = float(
+				self._token_bucket(
+					keys=[frappe.cache.make_key(self.rate_limit_key)],
+					args=[self.rate_limit, self.rate_limit_burst],
+				)
+			)
+			if wait <= 0:
+				return
+			sleep(wait)
+
+	def _session_request(self, method, endpoint, data, params=None, **kwargs):
+		"""
+		Same as woocommerce.API's request method, but sent through this client's keep-alive Session
+		"""
+		if params is None:
+			params = {}
+		url = self._API__get_url(endpoint)
+		auth = None
+		headers = {"user-agent": f"{self.user_agent}", "accept": "application/json"}
+
+		if self.is_ssl is True and self.query_string_auth is False:
+			auth = HTTPBasicAuth(self.consumer_key, self.consumer_secret)
+		elif self.is_ssl is True and self.query_string_auth is True:
+			params.update({"consumer_key": self.consumer_key, "consumer_secret": self.consumer_secret})
+		else:
+			encoded_params = urlencode(params)
+			url = f"{url}?{encoded_params}"
+			url = self._API__get_oauth_url(url, method, **kwargs)
+
+		if data is not None:
+			data = json.dumps(data, ensure_ascii=False).encode("utf-8")
+			headers["content-type"] = "application/json;charset=utf-8"
+
+		return self.session.request(
+			method=method,
+			url=url,
+			verify=self.verify_ssl,
+			auth=auth,
+			params=params,
+			data=data,
+			timeout=self.timeout,
+			headers=headers,
+			**kwargs,
+		)
+
+
+def get_keep_alive_session(pool_size: int) -> requests.Session:
+	"""
+	Returns a requests Session that keeps up to pool_size connections per host alive
+	"""
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount("https://", adapter)
+	session.mount("http://", adapter)
+	return session
+
+
+def is_retryable_response(response: requests.Response, idempotent: bool) -> bool:
+	"""
+	Returns True if the request should be sent again after receiving this response
+	"""
+	status_code = getattr(response, "status_code", None)
+	if status_code not in RETRY_STATUS_CODES:
+		return False
+
+	# A 429 response means that WooCommerce rejected the request without processing it
+	return idempotent or status_code == 429
+
+
+def is_retryable_exception(err: requests.exceptions.RequestException, idempotent: bool) -> bool:
+	"""
+	Returns True if the request should be sent again after it failed with this exception
+	"""
+	# A request that failed to connect never reached WooCommerce
+	if isinstance(err, requests.exceptions.ConnectTimeout):
+		return True
+
+	return idempotent and isinstance(
+		err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+	)
+
+
+def get_retry_delay(retries: int, response: Optional[requests.Response] = None) -> Optional[float]:
+	"""
+	Returns the number of seconds to wait before retrying a request, or None if it should not be
+	retried. Uses the response's Retry-After header if set, otherwise a jittered exponential backoff.
+	"""
+	retry_after = get_retry_after(response)
+	if retry_after is not None:
+		return retry_after if retry_after <= RETRY_AFTER_MAX else None
+
+	return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2**retries))
+
+
+def get_retry_after(response: Optional[requests.Response]) -> Optional[float]:
+	"""
+	Returns the number of seconds in a response's Retry-After header, which can either be a number
+	of seconds or an HTTP date
+	"""
+	headers = getattr(response, "headers", None) or {}
+	retry_after = headers.get("Retry-After")
+	if not retry_after:
+		return None
+
+	try:
+		return max(0.0, float(retry_after))
+	except (TypeError, ValueError):
+		pass
+
+	try:
+		retry_at = parsedate_to_datetime(retry_after)
+		return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+	except (TypeError, ValueError):
+		return None
+
+
+def get_circuit_breaker_keys(woocommerce_server: str) -> Tuple[str, str]:
+	"""
+	Returns the Redis keys of the failure counter and open flag of a WooCommerce Server's circuit breaker
+	"""
+	return (
+		frappe.cache.make_key(f"woocommerce_circuit_breaker_failures|{woocommerce_server}"),
+		frappe.cache.make_key(f"woocommerce_circuit_breaker_open|{woocommerce_server}"),
+	)
+
+
+def is_circuit_open(woocommerce_server: str) -> bool:
+	"""
+	Returns True if requests to the WooCommerce Server are paused
+	"""
+	_, open_key = get_circuit_breaker_keys(woocommerce_server)
+	return bool(frappe.cache.get(open_key))
+
+
+def record_request_success(woocommerce_server: str) -> None:
+	"""
+	Reset the failure counter of a WooCommerce Server's circuit breaker, and close it if it was open
+	"""
+	frappe.cache.delete(*get_circuit_breaker_keys(woocommerce_server))
+
+
+def record_request_failure(woocommerce_server: str) -> None:
+	"""
+	Count a failed request to a WooCommerce Server, and open its circuit breaker if too many requests
+	failed within the window
+	"""
+	failures_key, open_key = get_circuit_breaker_keys(woocommerce_server)
+	failures = frappe.cache.incr(failures_key)
+	if failures == 1:
+		frappe.cache.expire(failures_key, CIRCUIT_BREAKER_FAILURE_WINDOW)
+	if failures >= CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+		frappe.cache.set(open_key, str(now_datetime()), ex=CIRCUIT_BREAKER_OPEN_SECONDS)
+
+
+def get_circuit_breaker_state(woocommerce_server: str) -> Dict:
+	"""
+	Returns the state of a WooCommerce Server's circuit breaker
+	"""
+	failures_key, open_key = get_circuit_breaker_keys(woocommerce_server)
+	opened_at = frappe.cache.get(open_key)
+	return {
+		"state": "Open" if opened_at else "Closed",
+		"opened_at": opened_at.decode() if opened_at else None,
+		"failures": int(frappe.cache.get(failures_key) or 0),
+	}
+
 
 @redis_cache(ttl=86400)
 def is_woocommerce_request_logging_enabled(woocommerce_server_url: str) -> bool:
@@ -60,6 +429,63 @@ def is_woocommerce_request_logging_enabled(woocommerce_server_url: str) -> bool:
 	return enabled[0].enable_woocommerce_request_logs
 
 
+def get_request_log_values(
+	url: str,
+	endpoint: str,
+	request_method: str,
+	params: dict,
+	data: dict,
+	res: requests.Response | None = None,
+	error: str = None,
+	retries: int = 0,
+	max_body_size: int = REQUEST_LOG_MAX_BODY_SIZE,
+) -> Dict:
+	"""
+	Returns the field values of a 'WooCommerce Request Log' for a request, with bodies packed for storage
+	"""
+	return {
+		"user": frappe.session.user if frappe.session.user else None,
+		"url": url,
+		"endpoint": endpoint,
+		"method": request_method,
+		"params": pack_request_log_body(frappe.as_json(params) if params else None, max_body_size),
+		"data": pack_request_log_body(frappe.as_json(data) if data else None, max_body_size),
+		"response": pack_request_log_body(
+			f"{str(res)}\n{res.text}" if res is not None else None, max_body_size
+		),
+		"error": error,
+		"status": "Success" if res is not None and res.status_code in [200, 201] else "Error",
+		"time_elapsed": res.elapsed.total_seconds() if res is not None else None,
+		"retries": retries,
+	}
+
+
+def pack_request_log_body(body: Optional[str], max_body_size: int = REQUEST_LOG_MAX_BODY_SIZE):
+	"""
+	Truncate a request or response body to max_body_size characters (0 for no limit), and compress it
+	if it is large
+	"""
+	if not body or not isinstance(body, str):
+		return body
+
+	if max_body_size and len(body) > max_body_size:
+		body = f"{body[:max_body_size]}\n[... truncated {len(body) - max_body_size} characters]"
+
+	if len(body) < REQUEST_LOG_COMPRESS_MIN_SIZE:
+		return body
+
+	return COMPRESSED_BODY_PREFIX + base64.b64encode(zlib.compress(body.encode())).decode()
+
+
+def unpack_request_log_body(body: Optional[str]):
+	"""
+	Returns a body stored by pack_request_log_body in readable form
+	"""
+	if body and body.startswith(COMPRESSED_BODY_PREFIX):
+		return zlib.decompress(base64.b64decode(body[len(COMPRESSED_BODY_PREFIX) :])).decode()
+	return body
+
+
 def log_woocommerce_request(
 	url: str,
 	endpoint: str,
@@ -68,21 +494,75 @@ def log_woocommerce_request(
 	data: dict,
 	res: requests.Response | None = None,
 	traceback: str = None,
+	retries: int = 0,
 ):
-	request_log = frappe.get_doc(
-		{
-			"doctype": "WooCommerce Request Log",
-			"user": frappe.session.user if frappe.session.user else None,
-			"url": url,
-			"endpoint": endpoint,
-			"method": request_method,
-			"params": frappe.as_json(params) if params else None,
-			"data": frappe.as_json(data) if data else None,
-			"response": f"{str(res)}\n{res.text}" if res is not None else None,
-			"error": frappe.get_traceback(),
-			"status": "Success" if res and res.status_code in [200, 201] else "Error",
-			"time_elapsed": res.elapsed.total_seconds() if res is not None else None,
-		}
+	"""
+	Add a 'WooCommerce Request Log' for a request to the buffer
+	"""
+	buffer_woocommerce_request_log(
+		get_request_log_values(
+			url, endpoint, request_method, params, data, res, error=traceback, retries=retries
+		)
 	)
 
-	request_log.save(ignore_permissions=True)
+
+def buffer_woocommerce_request_log(request_log: Dict):
+	"""
+	Add a 'WooCommerce Request Log' to the buffer, and schedule a flush if the buffer is full
+	"""
+	request_log["creation"] = str(now_datetime())
+
+	# The pipeline talks to redis directly, so that the key is only prefixed once and the length of
+	# the buffer is returned
+	pipeline = frappe.cache.pipeline()
+	pipeline.rpush(
+		frappe.cache.make_key(REQUEST_LOG_BUFFER_KEY), frappe.as_json(request_log, indent=None)
+	)
+	(buffer_length,) = pipeline.execute()
+
+	if buffer_length == REQUEST_LOG_FLUSH_THRESHOLD:
+		frappe.enqueue(
+			"woocommerce_softland.tasks.utils.flush_woocommerce_request_logs",
+			job_id="woocommerce_request_log_flush",
+			deduplicate=True,
+		)
+
+
+def flush_woocommerce_request_logs():
+	"""
+	Insert all buffered 'WooCommerce Request Logs', REQUEST_LOG_FLUSH_THRESHOLD logs per query
+	"""
+	buffer_key = frappe.cache.make_key(REQUEST_LOG_BUFFER_KEY)
+	while True:
+		# Take logs from the buffer in one atomic operation
+		pipeline = frappe.cache.pipeline()
+		pipeline.lrange(buffer_key, 0, REQUEST_LOG_FLUSH_THRESHOLD - 1)
+		pipeline.ltrim(buffer_key, REQUEST_LOG_FLUSH_THRESHOLD, -1)
+		request_logs, _ = pipeline.execute()
+		if not request_logs:
+			break
+
+		insert_woocommerce_request_logs([json.loads(request_log) for request_log in request_logs])
+		frappe.db.commit()  # nosemgrep
+
+		if len(request_logs) < REQUEST_LOG_FLUSH_THRESHOLD:
+			break
+
+
+def insert_woocommerce_request_logs(request_logs: List[Dict]):
+	"""
+	Insert 'WooCommerce Request Logs' with a single multi-row insert
+	"""
+	fields = ["name", "owner", "modified_by", "creation", "modified", *REQUEST_LOG_FIELDS]
+	values = [
+		(
+			frappe.generate_hash(length=10),
+			request_log.get("user") or "Administrator",
+			request_log.get("user") or "Administrator",
+			request_log["creation"],
+			request_log["creation"],
+			*(request_log.get(field) for field in REQUEST_LOG_FIELDS),
+		)
+		for request_log in request_logs
+	]
+	frappe.db.bulk_insert("WooCommerce Request Log", fields=fields, values=values)
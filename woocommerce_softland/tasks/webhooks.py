@@ -0,0 +1,267 @@
+import json
+from typing import Dict, List, Tuple, Type
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import now_datetime, time_diff_in_seconds
+from frappe.utils.data import cstr
+
+from woocommerce_softland.tasks.sync_items import run_item_sync
+from woocommerce_softland.tasks.sync_sales_orders import run_sales_order_sync
+from woocommerce_softland.woocommerce.doctype.woocommerce_order.woocommerce_order import (
+	WC_ORDER_STATUS_MAPPING_REVERSE,
+	WooCommerceOrder,
+)
+from woocommerce_softland.woocommerce.doctype.woocommerce_product.woocommerce_product import (
+	WooCommerceProduct,
+)
+from woocommerce_softland.woocommerce.woocommerce_api import (
+	WooCommerceResource,
+	generate_woocommerce_record_name_from_domain_and_id,
+)
+
+# Payloads that waited longer than this many seconds to be processed may be out of date, so the
+# record is retrieved from WooCommerce instead
+WEBHOOK_PAYLOAD_MAX_AGE = 300
+
+# Maximum number of queued deliveries that are coalesced and processed at a time
+WEBHOOK_DRAIN_BATCH_SIZE = 100
+
+# Attributes that an order payload needs to have to be synchronised
+REQUIRED_ORDER_ATTRIBUTES = (
+	"id",
+	"status",
+	"date_created",
+	"date_created_gmt",
+	"date_modified",
+	"date_modified_gmt",
+	"billing",
+	"shipping",
+	"line_items",
+)
+
+# Attributes that a product payload needs to have to be synchronised
+REQUIRED_PRODUCT_ATTRIBUTES = (
+	"id",
+	"parent_id",
+	"type",
+	"name",
+	"sku",
+	"regular_price",
+	"attributes",
+	"images",
+	"date_created",
+	"date_created_gmt",
+	"date_modified",
+	"date_modified_gmt",
+)
+
+
+def enqueue_webhook_delivery_drain(enqueue_after_commit: bool = False):
+	"""
+	Schedule processing of the queued 'WooCommerce Webhook Deliveries', unless it has already been
+	scheduled.
+
+	Deliveries that are received while the job waits in the queue are coalesced by the job.
+	"""
+	frappe.enqueue(
+		"woocommerce_softland.tasks.webhooks.drain_webhook_deliveries",
+		queue="long",
+		job_id="woocommerce_webhook_delivery_drain",
+		deduplicate=True,
+		enqueue_after_commit=enqueue_after_commit,
+	)
+
+
+def drain_webhook_deliveries():
+	"""
+	Process all queued 'WooCommerce Webhook Deliveries', WEBHOOK_DRAIN_BATCH_SIZE deliveries at a
+	time, oldest first.
+
+	Payloads are stored as received, so they are parsed here. Only the newest delivery of every
+	record in a batch is processed; the other deliveries of that record are marked as Superseded.
+	"""
+	while True:
+		deliveries = frappe.get_all(
+			"WooCommerce Webhook Delivery",
+			filters={"status": "Queued"},
+			fields=["name", "woocommerce_server", "topic", "woocommerce_id", "payload", "creation"],
+			order_by="creation asc",
+			limit=WEBHOOK_DRAIN_BATCH_SIZE,
+		)
+		if not deliveries:
+			break
+
+		parsed_deliveries = set_woocommerce_ids_of_webhook_deliveries(deliveries)
+		newest_deliveries, superseded_deliveries = coalesce_webhook_deliveries(parsed_deliveries)
+		if superseded_deliveries:
+			frappe.db.set_value(
+				"WooCommerce Webhook Delivery",
+				{"name": ("in", [delivery.name for delivery in superseded_deliveries])},
+				"status",
+				"Superseded",
+				update_modified=False,
+			)
+		frappe.db.commit()  # nosemgrep
+
+		for delivery in newest_deliveries:
+			process_webhook_delivery(delivery.name)
+			frappe.db.commit()  # nosemgrep
+
+		if len(deliveries) < WEBHOOK_DRAIN_BATCH_SIZE:
+			break
+
+
+def set_woocommerce_ids_of_webhook_deliveries(deliveries: List[Dict]) -> List[Dict]:
+	"""
+	Set the WooCommerce ID of deliveries from their payload, and return the deliveries that have one.
+
+	Deliveries with a payload that cannot be parsed are marked as Failed.
+	"""
+	parsed_deliveries = []
+	for delivery in deliveries:
+		if not delivery.woocommerce_id:
+			try:
+				delivery.woocommerce_id = str(json.loads(delivery.payload)["id"])
+			except (ValueError, TypeError, KeyError):
+				frappe.db.set_value(
+					"WooCommerce Webhook Delivery",
+					delivery.name,
+					{"status": "Failed", "error": frappe.get_traceback()},
+				)
+				continue
+
+			frappe.db.set_value(
+				"WooCommerce Webhook Delivery",
+				delivery.name,
+				"woocommerce_id",
+				delivery.woocommerce_id,
+				update_modified=False,
+			)
+		parsed_deliveries.append(delivery)
+
+	return parsed_deliveries
+
+
+def coalesce_webhook_deliveries(deliveries: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+	"""
+	Split deliveries (sorted oldest first) into the newest delivery of every record, and the older
+	deliveries that it supersedes
+	"""
+	newest_deliveries = {}
+	superseded_deliveries = []
+	for delivery in deliveries:
+		resource = cstr(delivery.topic).split(".")[0]
+		key = (delivery.woocommerce_server, resource, delivery.woocommerce_id)
+		if key in newest_deliveries:
+			superseded_deliveries.append(newest_deliveries.pop(key))
+		newest_deliveries[key] = delivery
+
+	return list(newest_deliveries.values()), superseded_deliveries
+
+
+def process_webhook_delivery(delivery_name: str):
+	"""
+	Synchronise the record of a queued 'WooCommerce Webhook Delivery'
+	"""
+	delivery = frappe.get_doc("WooCommerce Webhook Delivery", delivery_name)
+	if delivery.status != "Queued":
+		return
+
+	try:
+		if delivery.topic.endswith(".deleted"):
+			process_deleted_webhook_delivery(delivery)
+		elif delivery.topic.startswith("order."):
+			run_sales_order_sync(
+				woocommerce_order=get_woocommerce_record_from_webhook_delivery(
+					delivery, WooCommerceOrder, REQUIRED_ORDER_ATTRIBUTES
+				)
+			)
+		elif delivery.topic.startswith("product."):
+			run_item_sync(
+				woocommerce_product=get_woocommerce_record_from_webhook_delivery(
+					delivery, WooCommerceProduct, REQUIRED_PRODUCT_ATTRIBUTES
+				)
+			)
+		delivery.status = "Processed"
+	except Exception:
+		frappe.db.rollback()
+		delivery.status = "Failed"
+		delivery.error = frappe.get_traceback()
+
+	delivery.save(ignore_permissions=True)
+
+
+def process_deleted_webhook_delivery(delivery: Document):
+	"""
+	Handle a record that was deleted in WooCommerce. Deleted records are never passed to the
+	synchronisation, as that would create or re-enable their ERPNext counterpart.
+
+	The Sales Orders of a deleted order get a WooCommerce Status of Trash, and the Items of a deleted
+	product stop being synchronised with it. Records without an ERPNext counterpart are skipped.
+	"""
+	if delivery.topic == "order.deleted":
+		frappe.db.set_value(
+			"Sales Order",
+			{
+				"woocommerce_server": delivery.woocommerce_server,
+				"woocommerce_id": delivery.woocommerce_id,
+				"docstatus": ("!=", 2),
+			},
+			"woocommerce_status",
+			WC_ORDER_STATUS_MAPPING_REVERSE["trash"],
+			update_modified=False,
+		)
+	elif delivery.topic == "product.deleted":
+		frappe.db.set_value(
+			"Item WooCommerce Server",
+			{
+				"woocommerce_server": delivery.woocommerce_server,
+				"woocommerce_id": delivery.woocommerce_id,
+			},
+			"enabled",
+			0,
+		)
+
+
+def get_woocommerce_record_from_webhook_delivery(
+	delivery: Document,
+	resource_class: Type[WooCommerceResource],
+	required_attributes: Tuple[str, ...],
+) -> WooCommerceResource:
+	"""
+	Returns the WooCommerce record (e.g. a WooCommerce Order) of a webhook delivery.
+
+	The record is built from the payload, unless the payload is incomplete or may be out of date, in
+	which case the record is retrieved from WooCommerce.
+	"""
+	payload = json.loads(delivery.payload)
+	if is_webhook_payload_usable(delivery, payload, required_attributes):
+		wc_server = frappe.get_cached_doc("WooCommerce Server", delivery.woocommerce_server)
+		return resource_class.get_doc_from_record(payload, wc_server.woocommerce_server_url)
+
+	wc_record = frappe.get_doc(
+		{
+			"doctype": resource_class.doctype,
+			"name": generate_woocommerce_record_name_from_domain_and_id(
+				domain=delivery.woocommerce_server, resource_id=delivery.woocommerce_id
+			),
+		}
+	)
+	wc_record.load_from_db()
+	return wc_record
+
+
+def is_webhook_payload_usable(
+	delivery: Document, payload: Dict, required_attributes: Tuple[str, ...]
+) -> bool:
+	"""
+	Returns true if a webhook payload has all the required attributes and is recent enough to be used
+	instead of retrieving the record from WooCommerce
+	"""
+	if not isinstance(payload, dict) or any(
+		attribute not in payload for attribute in required_attributes
+	):
+		return False
+
+	return time_diff_in_seconds(now_datetime(), delivery.creation) <= WEBHOOK_PAYLOAD_MAX_AGE
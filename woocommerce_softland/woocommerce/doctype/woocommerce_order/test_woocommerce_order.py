@@ -156,6 +156,187 @@ class TestWooCommerceOrder(FrappeTestCase):
 					param.expected_order_counts,
 				)
 
+	def test_get_list_requests_only_required_records_from_each_server(self, mock_init_api):
+		"""
+		Test that get_list requests records past the first page at the right offset from each server
+		"""
+		mock_api_list = [
+			WooCommerceOrderAPI(
+				api=Mock(),
+				woocommerce_server_url=f"http://site{x}.example.com",
+				woocommerce_server=f"site{x}.example.com",
+			)
+			for x in range(1, 4)
+		]
+		mock_init_api.return_value = mock_api_list
+
+		# Define mock responses that honour the offset and per_page parameters
+		order_counts = [150, 7, 300]
+		for nr_of_orders, woocommerce_api in zip(order_counts, mock_api_list):
+
+			def get_orders(endpoint, params, nr_of_orders=nr_of_orders):
+				orders = wc_response_for_list_of_orders(nr_of_orders)
+				mock_get_response = Mock()
+				mock_get_response.status_code = 200
+				mock_get_response.json.return_value = orders[
+					params["offset"] : params["offset"] + params["per_page"]
+				]
+				mock_get_response.headers = {"x-wp-total": nr_of_orders}
+				return mock_get_response
+
+			woocommerce_api.api.get.side_effect = get_orders
+
+		woocommerce_order = frappe.get_doc({"doctype": "WooCommerce Order"})
+		orders = woocommerce_order.get_list({"page_length": 20, "start": 145})
+
+		# Expect the last 5 orders of API 1, all 7 of API 2 and the first 8 of API 3
+		self.assertEqual(
+			[order.woocommerce_server for order in orders],
+			["site1.example.com"] * 5 + ["site2.example.com"] * 7 + ["site3.example.com"] * 8,
+		)
+		self.assertEqual(
+			[call.kwargs["params"]["offset"] for call in mock_api_list[0].api.get.call_args_list], [0, 145]
+		)
+		mock_api_list[1].api.get.assert_called_once()
+		mock_api_list[2].api.get.assert_called_once()
+
+	def test_iter_records_walks_every_page_once(self, mock_init_api):
+		"""
+		Test that iter_records requests each page of each server exactly once
+		"""
+		mock_api_list = [
+			WooCommerceOrderAPI(
+				api=Mock(),
+				woocommerce_server_url="http://site1.example.com",
+				woocommerce_server="site1.example.com",
+			),
+			WooCommerceOrderAPI(
+				api=Mock(),
+				woocommerce_server_url="http://site2.example.com",
+				woocommerce_server="site2.example.com",
+			),
+		]
+		mock_init_api.return_value = mock_api_list
+
+		# Every server has 3 pages of 100 orders
+		for woocommerce_api in mock_api_list:
+			mock_get_response = Mock()
+			mock_get_response.status_code = 200
+			mock_get_response.json.side_effect = lambda: wc_response_for_list_of_orders(100)
+			mock_get_response.headers = {"x-wp-total": 300, "x-wp-totalpages": 3}
+			woocommerce_api.api.get.return_value = mock_get_response
+
+		orders = list(WooCommerceOrder.iter_records())
+
+		self.assertEqual(len(orders), 600)
+		for woocommerce_api in mock_api_list:
+			requested_pages = [
+				call.kwargs["params"]["page"] for call in woocommerce_api.api.get.call_args_list
+			]
+			self.assertEqual(requested_pages, [1, 2, 3])
+
+	def test_iter_records_fetches_pages_concurrently_in_order(self, mock_init_api):
+		"""
+		Test that iter_records yields pages in order when they are fetched concurrently
+		"""
+		mock_api_list = [
+			WooCommerceOrderAPI(
+				api=Mock(),
+				woocommerce_server_url="http://site1.example.com",
+				woocommerce_server="site1.example.com",
+				max_concurrent_requests=3,
+			)
+		]
+		mock_init_api.return_value = mock_api_list
+
+		def get_page(endpoint, params):
+			# Return 100 orders with ids that identify the page they were returned on
+			orders = wc_response_for_list_of_orders(100)
+			for i, order in enumerate(orders):
+				order["id"] = (params["page"] - 1) * 100 + i
+			mock_get_response = Mock()
+			mock_get_response.status_code = 200
+			mock_get_response.json.return_value = orders
+			mock_get_response.headers = {"x-wp-total": 1000, "x-wp-totalpages": 10}
+			return mock_get_response
+
+		mock_api_list[0].api.get.side_effect = get_page
+
+		orders = list(WooCommerceOrder.iter_records())
+
+		self.assertEqual(mock_api_list[0].api.get.call_count, 10)
+		self.assertEqual([order["id"] for order in orders], list(range(1000)))
+
+	def test_iter_records_with_fields_requests_only_those_fields(self, mock_init_api):
+		"""
+		Test that iter_records passes a projection to WooCommerce, which includes the required fields
+		"""
+		mock_api_list = [
+			WooCommerceOrderAPI(
+				api=Mock(),
+				woocommerce_server_url="http://site1.example.com",
+				woocommerce_server="site1.example.com",
+			)
+		]
+		mock_init_api.return_value = mock_api_list
+
+		mock_get_response = Mock()
+		mock_get_response.status_code = 200
+		mock_get_response.json.return_value = wc_response_for_list_of_orders(2)
+		mock_get_response.headers = {"x-wp-total": 2, "x-wp-totalpages": 1}
+		mock_api_list[0].api.get.return_value = mock_get_response
+
+		orders = list(WooCommerceOrder.iter_records(fields=["status", "id"]))
+
+		self.assertEqual(len(orders), 2)
+		self.assertEqual(
+			mock_api_list[0].api.get.call_args.kwargs["params"]["_fields"],
+			"id,date_created,date_created_gmt,date_modified,date_modified_gmt,status",
+		)
+
+	def test_iter_modified_pages_uses_keyset_pagination(self, mock_init_api):
+		"""
+		Test that iter_modified_pages returns every modified order once without using offsets, also
+		when many orders share the same modification date
+		"""
+		wc_server = WooCommerceOrderAPI(
+			api=Mock(),
+			woocommerce_server_url="http://site1.example.com",
+			woocommerce_server="site1.example.com",
+		)
+
+		# 250 orders, modified in groups of 30 per second
+		all_orders = wc_response_for_list_of_orders(250)
+		for i, order in enumerate(all_orders):
+			order.id = i
+			order.date_modified_gmt = f"2024-01-01T00:00:{i // 30:02d}"
+
+		def get_orders(endpoint, params):
+			self.assertNotIn("offset", params)
+			self.assertNotIn("page", params)
+			excluded_ids = [int(id) for id in params.get("exclude", "").split(",") if id]
+			orders = [
+				order
+				for order in all_orders
+				if order.date_modified_gmt > params["modified_after"] and order.id not in excluded_ids
+			]
+			mock_get_response = Mock()
+			mock_get_response.status_code = 200
+			mock_get_response.json.return_value = deepcopy(orders[: params["per_page"]])
+			mock_get_response.headers = {}
+			return mock_get_response
+
+		wc_server.api.get.side_effect = get_orders
+
+		orders = [
+			order
+			for page in WooCommerceOrder.iter_modified_pages(wc_server, "2023-12-31T00:00:00")
+			for order in page
+		]
+
+		self.assertEqual([order["id"] for order in orders], list(range(250)))
+		self.assertEqual(wc_server.api.get.call_count, 3)
+
 	def test_load_from_db_initialises_doctype_with_all_values(self, mock_init_api):
 		"""
 		Test that load_from_db returns an Order
@@ -502,6 +683,23 @@ class TestWooCommerceOrder(FrappeTestCase):
 		# Check that the API was not called
 		mock_api_list[0].api.post.assert_not_called()
 
+	def test_serialize_uses_json_fields_from_meta(self, mock_init_api):
+		"""
+		Test that JSON fields are read from the doctype's meta instead of querying the database per record
+		"""
+		with patch.object(frappe.db, "get_all") as mock_get_all:
+			json_fields = WooCommerceOrder.get_json_fields()
+			record = WooCommerceOrder.serialize_attributes_of_type_dict_or_list(
+				{"billing": {"first_name": "John"}, "status": "processing"}
+			)
+
+		mock_get_all.assert_not_called()
+		self.assertIn("line_items", json_fields)
+		self.assertNotIn("status", json_fields)
+		self.assertIs(WooCommerceOrder.get_json_fields(), json_fields)
+		self.assertEqual(record["billing"], json.dumps({"first_name": "John"}))
+		self.assertEqual(record["status"], "processing")
+
 	def test_generate_woocommerce_record_name_from_domain_and_id(self, mock_init_api):
 		"""
 		Test that generate_woocommerce_record_name_from_domain_and_id function performs as expected
@@ -8,10 +8,10 @@ from typing import Dict, List
 
 import frappe
 
-from woocommerce_softland.tasks.utils import APIWithRequestLogging
 from woocommerce_softland.woocommerce.woocommerce_api import (
 	WooCommerceAPI,
 	WooCommerceResource,
+	get_api_client,
 	get_domain_and_id_from_woocommerce_record_name,
 	log_and_raise_error,
 )
@@ -37,8 +37,6 @@ WC_ORDER_STATUS_MAPPING = {
 }
 WC_ORDER_STATUS_MAPPING_REVERSE = {v: k for k, v in WC_ORDER_STATUS_MAPPING.items()}
 
-verify_ssl = not frappe._dev_server
-
 
 @dataclass
 class WooCommerceOrderAPI(WooCommerceAPI):
@@ -61,20 +59,14 @@ class WooCommerceOrder(WooCommerceResource):
 		Initialise the WooCommerce API
 		"""
 		wc_servers = frappe.get_all("WooCommerce Server")
-		wc_servers = [frappe.get_doc("WooCommerce Server", server.name) for server in wc_servers]
+		wc_servers = [frappe.get_cached_doc("WooCommerce Server", server.name) for server in wc_servers]
 
 		wc_api_list = [
 			WooCommerceOrderAPI(
-				api=APIWithRequestLogging(
-					url=server.woocommerce_server_url,
-					consumer_key=server.api_consumer_key,
-					consumer_secret=server.api_consumer_secret,
-					version="wc/v3",
-					timeout=40,
-					verify_ssl=verify_ssl,
-				),
+				api=get_api_client(server),
 				woocommerce_server_url=server.woocommerce_server_url,
 				woocommerce_server=server.name,
+				max_concurrent_requests=server.api_max_concurrent_requests,
 				wc_plugin_advanced_shipment_tracking=server.wc_plugin_advanced_shipment_tracking,
 			)
 			for server in wc_servers
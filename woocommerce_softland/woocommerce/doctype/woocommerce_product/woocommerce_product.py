@@ -3,7 +3,7 @@
 
 import json
 from dataclasses import dataclass
-from typing import Dict
+from typing import Dict, Iterator, List, Optional, Union
 
 from woocommerce_softland.woocommerce.woocommerce_api import WooCommerceAPI, WooCommerceResource
 
@@ -24,6 +24,14 @@ class WooCommerceProduct(WooCommerceResource):
 	resource: str = "products"
 	child_resource: str = "variations"
 	field_setter_map = {"woocommerce_name": "name", "woocommerce_id": "id"}
+	# Also needed to walk variations and to set the title of products
+	required_fields = WooCommerceResource.required_fields + (
+		"parent_id",
+		"type",
+		"name",
+		"sku",
+		"attributes",
+	)
 
 	# use "args" despite frappe-semgrep-rules.rules.overusing-args, following convention in ERPNext
 	# nosemgrep
@@ -45,6 +53,32 @@ class WooCommerceProduct(WooCommerceResource):
 
 		return products
 
+	@classmethod
+	def iter_records(
+		cls,
+		filters: Optional[List] = None,
+		servers: Optional[List[str]] = None,
+		endpoint: Optional[str] = None,
+		metadata: Optional[Dict] = None,
+		as_doc: bool = False,
+		fields: Optional[List[str]] = None,
+	) -> Iterator[Union[Dict, "WooCommerceProduct"]]:
+		"""
+		Yields WooCommerce Products, each variable product followed by its variations
+		"""
+		for product in super().iter_records(filters, servers, endpoint, metadata, as_doc, fields):
+			yield product
+
+			if not endpoint and product.get("type") == "variable":
+				yield from super().iter_records(
+					filters,
+					servers=[product.get("woocommerce_server")],
+					endpoint=f"products/{product.get('id')}/variations",
+					metadata={"parent_woocommerce_name": product.get("woocommerce_name")},
+					as_doc=as_doc,
+					fields=fields,
+				)
+
 	def after_load_from_db(self, product: Dict):
 		product.pop("name")
 		product = self.set_title(product)
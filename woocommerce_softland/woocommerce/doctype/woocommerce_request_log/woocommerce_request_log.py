@@ -4,8 +4,15 @@
 import frappe
 from frappe.model.document import Document
 
+from woocommerce_softland.tasks.utils import unpack_request_log_body
+
 
 class WooCommerceRequestLog(Document):
+	def onload(self):
+		# Show compressed bodies in readable form
+		for fieldname in ("params", "data", "response"):
+			self.set(fieldname, unpack_request_log_body(self.get(fieldname)))
+
 	@staticmethod
 	def clear_old_logs(days=7):
 		from frappe.query_builder import Interval
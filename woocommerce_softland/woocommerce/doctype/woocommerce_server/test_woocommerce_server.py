@@ -1,9 +1,43 @@
 # Copyright (c) 2023, Dirk van der Laarse and Contributors
 # See license.txt
 
-# import frappe
+from unittest.mock import patch
+
+import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from woocommerce_softland.woocommerce.woocommerce_api import clear_api_client, get_api_client
+
 
 class TestWooCommerceServer(FrappeTestCase):
-	pass
+	def test_get_api_client_reuses_client_until_server_changes(self):
+		"""
+		Test that the API client registry hands out the same pooled client until the WooCommerce Server changes
+		"""
+		wc_server = frappe._dict(
+			name="registry.example.com",
+			modified="2024-01-01 00:00:00",
+			woocommerce_server_url="https://registry.example.com",
+			api_consumer_key="ck",
+			api_consumer_secret="cs",
+			api_connection_pool_size=5,
+		)
+
+		api_client = get_api_client(wc_server)
+		self.assertIs(get_api_client(wc_server), api_client)
+		self.assertIsNotNone(api_client.session)
+
+		# A changed modified timestamp should replace the client, without closing the old one
+		wc_server.modified = "2024-01-02 00:00:00"
+		with patch.object(api_client, "close") as mock_close:
+			self.assertIsNot(get_api_client(wc_server), api_client)
+		mock_close.assert_not_called()
+
+		# Clearing the client should not close it either
+		api_client = get_api_client(wc_server)
+		with patch.object(api_client, "close") as mock_close:
+			clear_api_client(wc_server.name)
+		mock_close.assert_not_called()
+		self.assertIsNot(get_api_client(wc_server), api_client)
+
+		clear_api_client(wc_server.name)
@@ -3,6 +3,26 @@
 
 frappe.ui.form.on('WooCommerce Server', {
 	refresh: function(frm) {
+		// Show a warning if requests to this WooCommerce Server are paused by its circuit breaker
+		const circuit_breaker = frm.doc.__onload && frm.doc.__onload.circuit_breaker;
+		if (circuit_breaker && circuit_breaker.state === "Open") {
+			frm.dashboard.set_headline_alert(
+				`<div class="form-message red">
+					<div>
+						${__("Requests to this WooCommerce Server are paused since {0} because too many requests failed. They will resume as soon as the server responds again.", [frappe.datetime.str_to_user(circuit_breaker.opened_at)])}
+					</div>
+				</div>`
+			);
+		} else if (circuit_breaker && circuit_breaker.failures) {
+			frm.dashboard.set_headline_alert(
+				`<div class="form-message yellow">
+					<div>
+						${__("{0} recent requests to this WooCommerce Server failed", [circuit_breaker.failures])}
+					</div>
+				</div>`
+			);
+		}
+
 		// Only list enabled warehouses
 		frm.fields_dict.warehouses.get_query = function (doc) {
 			return {
@@ -125,17 +145,16 @@ frappe.ui.form.on('WooCommerce Server', {
 					read_only: 1
 				},
 				{
-					label: __('Topic'),
-					fieldname: 'topic',
-					fieldtype: 'Data',
-					default: 'Order created',
-					read_only: 1
-				},
-				{
-					label: __('Delivery URL'),
-					fieldname: 'url',
-					fieldtype: 'Data',
-					default: '<site url here>/api/method/woocommerce_softland.woocommerce_endpoint.order_created',
+					label: __('Topics and Delivery URLs'),
+					fieldname: 'topics',
+					fieldtype: 'Code',
+					default: [
+						'Order created', 'Order updated', 'Order deleted',
+						'Product created', 'Product updated', 'Product deleted'
+					].map(
+						(topic) => `${topic}: <site url here>/api/method/woocommerce_softland.woocommerce_endpoint.${topic.toLowerCase().replace(' ', '_')}`
+					).join('\n'),
+					description: __('Create a webhook in WooCommerce for each of these topics'),
 					read_only: 1
 				},
 				{
@@ -9,14 +9,16 @@ from frappe import _
 from frappe.model.document import Document
 from frappe.utils.caching import redis_cache
 from jsonpath_ng.ext import parse
-from woocommerce import API
 
+from woocommerce_softland.tasks.utils import get_circuit_breaker_state
 from woocommerce_softland.woocommerce.doctype.woocommerce_order.woocommerce_order import (
 	WC_ORDER_STATUS_MAPPING,
 )
-from woocommerce_softland.woocommerce.woocommerce_api import parse_domain_from_url
-
-verify_ssl = not frappe._dev_server
+from woocommerce_softland.woocommerce.woocommerce_api import (
+	clear_api_client,
+	get_api_client,
+	parse_domain_from_url,
+)
 
 
 class WooCommerceServer(Document):
@@ -26,6 +28,10 @@ class WooCommerceServer(Document):
 		"""
 		self.name = parse_domain_from_url(self.woocommerce_server_url)
 
+	def onload(self):
+		# Show whether requests to this WooCommerce Server are paused
+		self.set_onload("circuit_breaker", get_circuit_breaker_state(self.name))
+
 	def validate(self):
 		# Validate URL
 		result = urlparse(self.woocommerce_server_url)
@@ -43,6 +49,14 @@ class WooCommerceServer(Document):
 		self.validate_item_map()
 		self.validate_reserved_stock_setting()
 
+	def on_update(self):
+		# Release this worker's pooled connections; other workers replace their clients when they
+		# notice the changed modified timestamp
+		clear_api_client(self.name)
+
+	def on_trash(self):
+		clear_api_client(self.name)
+
 	def validate_so_status_map(self):
 		"""
 		Validate Sales Order Status Map to have unique mappings
@@ -101,14 +115,7 @@ class WooCommerceServer(Document):
 		returns a newline-separated string of all provider names.
 		"""
 
-		wc_api = API(
-			url=self.woocommerce_server_url,
-			consumer_key=self.api_consumer_key,
-			consumer_secret=self.api_consumer_secret,
-			version="wc/v3",
-			timeout=40,
-			verify_ssl=verify_ssl,
-		)
+		wc_api = get_api_client(self)
 		all_providers = wc_api.get("orders/1/shipment-trackings/providers").json()
 		if all_providers:
 			provider_names = [provider for country in all_providers for provider in all_providers[country]]
@@ -0,0 +1,51 @@
+# Copyright (c) 2026, Dirk van der Laarse and Contributors
+# See license.txt
+
+from unittest.mock import patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from woocommerce_softland.woocommerce.doctype.woocommerce_sync_cursor.woocommerce_sync_cursor import (
+	WooCommerceSyncCursor,
+)
+
+SYNC_CURSOR_MODULE = "woocommerce_softland.woocommerce.doctype.woocommerce_sync_cursor.woocommerce_sync_cursor"
+
+
+class TestWooCommerceSyncCursor(FrappeTestCase):
+	def get_cursor(self):
+		return frappe.get_doc(
+			{
+				"doctype": "WooCommerce Sync Cursor",
+				"woocommerce_server": "cursor.example.com",
+				"resource": "Orders",
+			}
+		)
+
+	def test_scan_starts_before_cursor(self):
+		"""
+		Test that a scan resumes a little before the cursor, unless a start date is given
+		"""
+		cursor = self.get_cursor()
+		self.assertEqual(
+			cursor.get_scan_start(default="2024-01-01 00:00:00"), ("2024-01-01 00:00:00", False)
+		)
+
+		cursor.last_date_modified_gmt = "2024-06-01 10:00:00"
+		self.assertEqual(
+			cursor.get_scan_start(default="2024-01-01 00:00:00"), ("2024-06-01T09:58:00", True)
+		)
+		self.assertEqual(cursor.get_scan_start("2024-05-01 00:00:00"), ("2024-05-01 00:00:00", False))
+
+	@patch(f"{SYNC_CURSOR_MODULE}.frappe.db.commit")
+	@patch.object(WooCommerceSyncCursor, "save")
+	def test_cursor_only_moves_forward(self, mock_save, mock_commit):
+		cursor = self.get_cursor()
+
+		cursor.advance("2024-06-01T10:00:00")
+		cursor.advance("2024-06-01T09:00:00")
+
+		mock_save.assert_called_once()
+		mock_commit.assert_called_once()
+		self.assertEqual(str(cursor.last_date_modified_gmt), "2024-06-01 10:00:00")
@@ -0,0 +1,75 @@
+# Copyright (c) 2026, Dirk van der Laarse and contributors
+# For license information, please see license.txt
+
+from datetime import timedelta
+from typing import Optional, Tuple
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import get_datetime
+
+# Synchronisation resumes this many seconds before the cursor, so that records modified within the
+# same second as the last synchronised record, or committed late by WooCommerce, are not missed
+SYNC_CURSOR_OVERLAP_SECONDS = 120
+
+
+class WooCommerceSyncCursor(Document):
+	def get_modified_after(self) -> Optional[str]:
+		"""
+		Returns the modification date (GMT) from which synchronisation should resume
+		"""
+		if not self.last_date_modified_gmt:
+			return None
+
+		modified_after = get_datetime(self.last_date_modified_gmt) - timedelta(
+			seconds=SYNC_CURSOR_OVERLAP_SECONDS
+		)
+		return modified_after.strftime("%Y-%m-%dT%H:%M:%S")
+
+	def get_scan_start(self, date_time_from=None, default=None) -> Tuple[Optional[str], bool]:
+		"""
+		Returns the date from which to scan for modified records, and whether that date is in GMT.
+
+		A given date_time_from takes precedence over the cursor, and the default is used if the
+		cursor has not been set yet. Both are in the system's timezone.
+		"""
+		if date_time_from:
+			return str(date_time_from), False
+		if modified_after := self.get_modified_after():
+			return modified_after, True
+		if default:
+			return str(default), False
+		return None, False
+
+	def advance(self, date_modified_gmt: str):
+		"""
+		Move the cursor to the last record of a page that has been synchronised, and commit
+		"""
+		date_modified_gmt = get_datetime(date_modified_gmt)
+		if self.last_date_modified_gmt and date_modified_gmt < get_datetime(
+			self.last_date_modified_gmt
+		):
+			return
+
+		self.last_date_modified_gmt = date_modified_gmt
+		self.save(ignore_permissions=True)
+		frappe.db.commit()  # nosemgrep
+
+
+def get_sync_cursor(woocommerce_server: str, resource: str) -> WooCommerceSyncCursor:
+	"""
+	Returns the sync cursor of a WooCommerce Server's resource, which is new if it has never been synchronised
+	"""
+	name = frappe.db.get_value(
+		"WooCommerce Sync Cursor", {"woocommerce_server": woocommerce_server, "resource": resource}
+	)
+	if name:
+		return frappe.get_doc("WooCommerce Sync Cursor", name)
+
+	return frappe.get_doc(
+		{
+			"doctype": "WooCommerce Sync Cursor",
+			"woocommerce_server": woocommerce_server,
+			"resource": resource,
+		}
+	)
@@ -0,0 +1,18 @@
+# Copyright (c) 2026, Dirk van der Laarse and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class WooCommerceWebhookDelivery(Document):
+	@staticmethod
+	def clear_old_logs(days=7):
+		from frappe.query_builder import Interval
+		from frappe.query_builder.functions import Now
+
+		table = frappe.qb.DocType("WooCommerce Webhook Delivery")
+		frappe.db.delete(
+			table,
+			filters=(table.modified < (Now() - Interval(days=days))) & (table.status != "Queued"),
+		)
@@ -1,6 +1,12 @@
+import contextvars
 import json
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple, Union
+from datetime import timedelta
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import frappe
@@ -9,9 +15,11 @@ from frappe.model.document import Document
 from frappe.utils import format_datetime, get_datetime
 
 from woocommerce_softland.exceptions import SyncDisabledError
-from woocommerce_softland.tasks.utils import APIWithRequestLogging
+from woocommerce_softland.tasks.utils import APIWithRequestLogging, is_circuit_open
 
 WC_RESOURCE_DELIMITER = "~"
+WC_RECORDS_PER_PAGE_LIMIT = 100
+DEFAULT_API_CONNECTION_POOL_SIZE = 10
 
 verify_ssl = not frappe._dev_server
 
@@ -28,6 +36,95 @@ class WooCommerceAPI:
 	api: APIWithRequestLogging
 	woocommerce_server_url: str
 	woocommerce_server: str
+	max_concurrent_requests: int = 1
+
+
+# Long-lived API clients for this worker process, keyed by (site, WooCommerce Server name)
+_api_client_registry: Dict[Tuple[str, str], Tuple[Tuple, APIWithRequestLogging]] = {}
+_api_client_registry_lock = threading.Lock()
+
+
+def get_api_client(wc_server: Union[Document, str]) -> APIWithRequestLogging:
+	"""
+	Returns the pooled API client for a WooCommerce Server, creating it on first use.
+
+	Clients are reused for the lifetime of the worker process. A client is replaced as soon as the
+	WooCommerce Server's connection settings or modified timestamp change, so saving the
+	WooCommerce Server invalidates it in every worker. A replaced client is not closed, as other
+	threads may still be sending requests with it; its connections are released once it is garbage
+	collected.
+	"""
+	if isinstance(wc_server, str):
+		wc_server = frappe.get_cached_doc("WooCommerce Server", wc_server)
+
+	registry_key = (frappe.local.site, wc_server.name)
+	fingerprint = (
+		str(wc_server.modified),
+		wc_server.woocommerce_server_url,
+		wc_server.api_consumer_key,
+		wc_server.api_consumer_secret,
+		wc_server.api_connection_pool_size,
+		wc_server.api_rate_limit,
+		wc_server.api_rate_limit_burst,
+		wc_server.enable_woocommerce_request_logs,
+		wc_server.enable_woocommerce_request_log_stack,
+		wc_server.woocommerce_request_log_mode,
+		wc_server.woocommerce_request_log_sample_rate,
+		wc_server.woocommerce_request_log_max_body_size,
+	)
+
+	with _api_client_registry_lock:
+		registered = _api_client_registry.get(registry_key)
+		if registered and registered[0] == fingerprint:
+			return registered[1]
+
+		api_client = APIWithRequestLogging(
+			url=wc_server.woocommerce_server_url,
+			consumer_key=wc_server.api_consumer_key,
+			consumer_secret=wc_server.api_consumer_secret,
+			version="wc/v3",
+			timeout=40,
+			verify_ssl=verify_ssl,
+			pool_size=wc_server.api_connection_pool_size or DEFAULT_API_CONNECTION_POOL_SIZE,
+			rate_limit=wc_server.api_rate_limit,
+			rate_limit_burst=wc_server.api_rate_limit_burst,
+			woocommerce_server=wc_server.name,
+			log_requests=bool(wc_server.enable_woocommerce_request_logs),
+			log_request_stack=bool(wc_server.enable_woocommerce_request_log_stack),
+			log_mode=wc_server.woocommerce_request_log_mode,
+			log_sample_rate=wc_server.woocommerce_request_log_sample_rate,
+			log_max_body_size=(wc_server.woocommerce_request_log_max_body_size or 0) * 1024,
+		)
+		_api_client_registry[registry_key] = (fingerprint, api_client)
+
+	return api_client
+
+
+def clear_api_client(woocommerce_server: str):
+	"""
+	Remove a WooCommerce Server's API client from this worker's registry. The client is not closed,
+	as other threads may still be sending requests with it.
+	"""
+	with _api_client_registry_lock:
+		_api_client_registry.pop((frappe.local.site, woocommerce_server), None)
+
+
+def probe_open_circuit_breakers():
+	"""
+	Send a single small request to every WooCommerce Server whose circuit breaker is open. The
+	circuit breaker is closed if the WooCommerce Server responds again.
+	"""
+	for woocommerce_server in frappe.get_all("WooCommerce Server", {"enable_sync": 1}, pluck="name"):
+		if not is_circuit_open(woocommerce_server):
+			continue
+
+		try:
+			get_api_client(woocommerce_server).get(
+				"products", params={"per_page": 1, "_fields": "id"}, ignore_circuit_breaker=True
+			)
+		except Exception:
+			# The failure has been recorded by the circuit breaker, the circuit remains open
+			pass
 
 
 class WooCommerceResource(Document):
@@ -39,26 +136,32 @@ class WooCommerceResource(Document):
 	child_resource: str = None
 	field_setter_map: Dict = None
 
+	# Attributes that are always requested when records are retrieved with a projection (_fields),
+	# as they are needed to initialise a Document
+	required_fields: Tuple[str, ...] = (
+		"id",
+		"date_created",
+		"date_created_gmt",
+		"date_modified",
+		"date_modified_gmt",
+	)
+	# The attributes that were requested if this record was loaded with a projection
+	projected_fields: Optional[Tuple[str, ...]] = None
+
 	@staticmethod
 	def _init_api() -> List[WooCommerceAPI]:
 		"""
 		Initialise the WooCommerce API
 		"""
 		wc_servers = frappe.get_all("WooCommerce Server")
-		wc_servers = [frappe.get_doc("WooCommerce Server", server.name) for server in wc_servers]
+		wc_servers = [frappe.get_cached_doc("WooCommerce Server", server.name) for server in wc_servers]
 
 		wc_api_list = [
 			WooCommerceAPI(
-				api=APIWithRequestLogging(
-					url=server.woocommerce_server_url,
-					consumer_key=server.api_consumer_key,
-					consumer_secret=server.api_consumer_secret,
-					version="wc/v3",
-					timeout=40,
-					verify_ssl=verify_ssl,
-				),
+				api=get_api_client(server),
 				woocommerce_server_url=server.woocommerce_server_url,
 				woocommerce_server=server.name,
+				max_concurrent_requests=server.api_max_concurrent_requests,
 			)
 			for server in wc_servers
 			if server.enable_sync == 1
@@ -85,9 +188,7 @@ class WooCommerceResource(Document):
 		"""
 		Allow for dict-like behaviour when using jsonpath-ng
 		"""
-		fields = [field.fieldname for field in self.meta.fields]
-		fields.append("name")
-		return key in fields
+		return key == "name" or key in get_fieldnames(self.doctype)
 
 	def init_api(self):
 		"""
@@ -95,9 +196,12 @@ class WooCommerceResource(Document):
 		"""
 		self.wc_api_list = self._init_api()
 
-	def load_from_db(self):
+	def load_from_db(self, fields: Optional[List[str]] = None):
 		"""
 		Returns a single WooCommerce Record (Form view)
+
+		If fields are given, only these attributes (and the required_fields) are retrieved. Only the
+		given fields will be written when the record is saved.
 		"""
 		# Verify that the WC API has been initialised
 		if not self.wc_api_list:
@@ -113,7 +217,12 @@ class WooCommerceResource(Document):
 
 		# Get WooCommerce Record
 		try:
-			record = self.current_wc_api.api.get(f"{self.resource}/{record_id}").json()
+			if fields is not None:
+				record = self.current_wc_api.api.get(
+					f"{self.resource}/{record_id}", params={"_fields": self.get_fields_param(fields)}
+				).json()
+			else:
+				record = self.current_wc_api.api.get(f"{self.resource}/{record_id}").json()
 		except Exception as err:
 			error_text = (
 				f"load_from_db failed (WooCommerce {self.resource} #{record_id})\n\n{frappe.get_traceback()}"
@@ -131,6 +240,17 @@ class WooCommerceResource(Document):
 		record = self.after_load_from_db(record)
 
 		self.call_super_init(record)
+		self.projected_fields = tuple(fields) if fields is not None else None
+
+	def load_doc_before_save(self, *args, **kwargs):
+		"""
+		Compare a record that was loaded with a projection with the same projection when it is saved
+		"""
+		if self.projected_fields is None:
+			return super().load_doc_before_save(*args, **kwargs)
+
+		self._doc_before_save = frappe.get_doc({"doctype": self.doctype, "name": self.name})
+		self._doc_before_save.load_from_db(fields=self.projected_fields)
 
 	def call_super_init(self, record: Dict):
 		super(Document, self).__init__(record)
@@ -143,15 +263,18 @@ class WooCommerceResource(Document):
 		"""
 		Returns List of WooCommerce Records (List view and Report view).
 
-		First make a single API call for each API in the list and check if its total record count
-		falls within the required range. If not, we adjust the offset for the next API and
-		continue to the next one. Otherwise, we start retrieving the required records.
+		First make a single API call to each API in the list, concurrently, to get its total record
+		count. From these counts we determine which part of the requested range falls on each API,
+		in the order of the list. Any further records that are required are then also retrieved
+		concurrently, and the results are merged in the order of the list.
+
+		Pass a list of WooCommerce attributes as args["wc_fields"] to only retrieve these attributes.
 		"""
 		# Initialise the WC API
 		wc_api_list = cls._init_api()
 
 		if len(wc_api_list) > 0:
-			wc_records_per_page_limit = 100
+			wc_records_per_page_limit = WC_RECORDS_PER_PAGE_LIMIT
 
 			# Map Frappe query parameters to WooCommerce query parameters
 			params = {}
@@ -162,98 +285,297 @@ class WooCommerceResource(Document):
 			)
 			offset = int(args["start"]) if args and "start" in args else 0
 			params["per_page"] = min(per_page + offset, wc_records_per_page_limit)
+			params["offset"] = 0
 
 			# Map Frappe filters to WooCommerce parameters
 			if "filters" in args and args["filters"]:
 				updated_params = get_wc_parameters_from_filters(args["filters"])
 				params.update(updated_params)
 
-			# Initialse required variables
-			all_results = []
-			total_processed = 0
+			if args.get("wc_fields", None) is not None:
+				params["_fields"] = cls.get_fields_param(args["wc_fields"])
 
-			for wc_server in wc_api_list:
-				# Skip this API call if one or more servers were specified
-				if args.get("servers", None):
-					if wc_server.woocommerce_server not in args["servers"]:
-						continue
+			# Skip APIs if one or more servers were specified
+			if args.get("servers", None):
+				wc_api_list = [
+					wc_server for wc_server in wc_api_list if wc_server.woocommerce_server in args["servers"]
+				]
 
-				current_offset = 0
+			endpoint = args["endpoint"] if "endpoint" in args else cls.resource
 
-				# Get WooCommerce Records
-				params["offset"] = current_offset
-				try:
-					endpoint = args["endpoint"] if "endpoint" in args else cls.resource
-					response = wc_server.api.get(endpoint, params=params)
-				except Exception as err:
-					log_and_raise_error(err, error_text="get_list failed")
-				if response.status_code != 200:
-					log_and_raise_error(error_text="get_list failed", response=response)
+			# Get the first page of WooCommerce Records from every API
+			responses = fan_out(wc_api_list, get_page, endpoint, params)
+
+			# Work out which records are required from each API
+			first_results = []
+			required_ranges = []
+			total_processed = 0
+			for response in responses:
+				response = validate_page_response(response, error_text="get_list failed")
 
 				# Store the count of total records in this API
 				# Handle some endpoints that do not return the count in the header
+				results = response.json()
 				if "x-wp-total" in response.headers:
 					count_of_total_records_in_api = int(response.headers["x-wp-total"])
 				else:
 					try:
-						count_of_total_records_in_api = len(response.json())
+						count_of_total_records_in_api = len(results)
 					except Exception as err:
 						log_and_raise_error(error_text="Unexpected response", response=response)
 
-				# Skip this API if all its records fall before the required offset
-				if count_of_total_records_in_api <= offset - total_processed:
-					total_processed += count_of_total_records_in_api
-					continue
+				start = max(0, offset - total_processed)
+				end = max(start, min(count_of_total_records_in_api, offset + per_page - total_processed))
+				first_results.append(results)
+				required_ranges.append((start, end))
+				total_processed += count_of_total_records_in_api
+
+			# Get the remaining required records that were not on the first page
+			remaining_params = [
+				{**params, "offset": max(start, len(results)), "per_page": end - max(start, len(results))}
+				if end > len(results)
+				else None
+				for results, (start, end) in zip(first_results, required_ranges)
+			]
+			remaining_responses = fan_out(
+				wc_api_list,
+				lambda wc_server, server_params: (
+					get_page(wc_server, endpoint, server_params) if server_params else None
+				),
+				remaining_params,
+			)
 
-				# Parse the response
-				results = response.json()
+			# Merge the results in the order of the APIs
+			all_results = []
+			for wc_server, results, (start, end), response in zip(
+				wc_api_list, first_results, required_ranges, remaining_responses
+			):
+				required_results = results[start:end]
+				if response is not None:
+					response = validate_page_response(response, error_text="get_list failed")
+					required_results += response.json()
 
-				# If we're still here, it means that this API has some records in the required range
-				while True:
-					if len(all_results) >= per_page:
-						if args.get("as_doc", None):
-							return [frappe.get_doc(record) for record in all_results]
-						else:
-							return all_results
+				# Add frappe fields to records
+				for record in required_results:
+					cls.pre_init_document(record=record, woocommerce_server_url=wc_server.woocommerce_server_url)
 
-					# Adjust indices based on remaining offset and records to collect
-					start = max(0, offset - total_processed)
-					end = min(len(results), per_page - len(all_results) + start)
+					cls.during_get_list_of_records(record, args)
 
-					# Add frappe fields to records
-					for record in results[start:end]:
-						cls.pre_init_document(record=record, woocommerce_server_url=wc_server.woocommerce_server_url)
+				all_results.extend(required_results)
 
-						cls.during_get_list_of_records(record, args)
+			if args.get("as_doc", None):
+				return [frappe.get_doc(record) for record in all_results]
+			else:
+				return all_results
 
-					all_results.extend(results[start:end])
-					total_processed += len(results)
+	@classmethod
+	def iter_records(
+		cls,
+		filters: Optional[List] = None,
+		servers: Optional[List[str]] = None,
+		endpoint: Optional[str] = None,
+		metadata: Optional[Dict] = None,
+		as_doc: bool = False,
+		fields: Optional[List[str]] = None,
+	) -> Iterator[Union[Dict, "WooCommerceResource"]]:
+		"""
+		Yields WooCommerce Records matching the filters, for use by background jobs.
 
-					# Check if there are no more records available or required
-					if len(results) < per_page:
-						break
+		Unlike get_list_of_records, which serves a single page of the List view, this walks every
+		page of each server exactly once and yields records as the pages arrive.
 
-					current_offset += params["per_page"]
+		If fields are given, only these attributes (and the required_fields) are retrieved.
+		"""
+		wc_api_list = cls._init_api()
 
-					# Get WooCommerce Records
-					params["offset"] = current_offset
-					try:
-						response = wc_server.api.get(cls.resource, params=params)
-					except Exception as err:
-						log_and_raise_error(err, error_text="get_list failed")
-					if response.status_code != 200:
-						log_and_raise_error(error_text="get_list failed", response=response)
-					results = response.json()
+		params = {"per_page": WC_RECORDS_PER_PAGE_LIMIT}
+		if filters:
+			params.update(get_wc_parameters_from_filters(filters))
+		if fields is not None:
+			params["_fields"] = cls.get_fields_param(fields)
+
+		# Arguments passed on to during_get_list_of_records, in the same shape as get_list's args
+		args = {"endpoint": endpoint, "metadata": metadata or {}}
+
+		# Skip APIs if one or more servers were specified
+		if servers:
+			wc_api_list = [
+				wc_server for wc_server in wc_api_list if wc_server.woocommerce_server in servers
+			]
+
+		# Get the first page from every API concurrently, so that a slow server doesn't delay the others
+		first_pages = fan_out(wc_api_list, get_page, endpoint or cls.resource, params, 1)
+
+		for wc_server, first_page in zip(wc_api_list, first_pages):
+			for results in cls.iter_pages(
+				wc_server, endpoint or cls.resource, params, first_page=first_page
+			):
+				for record in results:
+					cls.pre_init_document(record=record, woocommerce_server_url=wc_server.woocommerce_server_url)
+					cls.during_get_list_of_records(record, args)
+					yield frappe.get_doc(record) if as_doc else record
 
-			if args.get("as_doc", None):
-				return [frappe.get_doc(record) for record in all_results]
-			else:
-				return all_results
+	@classmethod
+	def iter_modified_pages(
+		cls,
+		wc_server: WooCommerceAPI,
+		modified_after: str,
+		dates_are_gmt: bool = True,
+		filters: Optional[List] = None,
+		endpoint: Optional[str] = None,
+		metadata: Optional[Dict] = None,
+		fields: Optional[List[str]] = None,
+	) -> Iterator[List[Dict]]:
+		"""
+		Yields pages of the WooCommerce Records of a server that were modified after modified_after.
+
+		Records are ordered by modification date, least recently modified first, so that the last
+		record of each page marks how far a scan has progressed. Records that are modified during
+		the scan move to the end and are not missed. Pages are retrieved with keyset pagination, see
+		iter_keyset_pages.
+		"""
+		params = {"per_page": WC_RECORDS_PER_PAGE_LIMIT, "modified_after": modified_after}
+		if dates_are_gmt:
+			params["dates_are_gmt"] = "true"
+		if filters:
+			params.update(get_wc_parameters_from_filters(filters))
+		if fields is not None:
+			params["_fields"] = cls.get_fields_param(fields)
+
+		# Arguments passed on to during_get_list_of_records, in the same shape as get_list's args
+		args = {"endpoint": endpoint, "metadata": metadata or {}}
+
+		for results in cls.iter_keyset_pages(wc_server, endpoint or cls.resource, params):
+			for record in results:
+				cls.pre_init_document(record=record, woocommerce_server_url=wc_server.woocommerce_server_url)
+				cls.during_get_list_of_records(record, args)
+			yield results
+
+	@staticmethod
+	def iter_keyset_pages(
+		wc_server: WooCommerceAPI, endpoint: str, params: Dict
+	) -> Iterator[List[Dict]]:
+		"""
+		Yields the pages of records of a WooCommerce list endpoint, least recently modified first,
+		using keyset pagination.
+
+		Instead of skipping an ever growing number of records with an offset, every page after the
+		first asks for the records modified after the second before the last record of the previous
+		page, excluding the records of that second that have already been returned. Every page
+		therefore costs WooCommerce the same to query, and a scan can be resumed from any record.
+
+		The records must include date_modified_gmt and id.
+		"""
+		params = {**params, "orderby": "modified", "order": "asc"}
+		last_modified = None
+		returned_ids = []
+
+		while True:
+			results, _ = parse_page_response(get_page(wc_server, endpoint, params))
+			if not results:
+				return
+
+			# Keep track of the records of the last second that have been returned, WooCommerce only
+			# stores modification dates to the second
+			page_last_modified = get_datetime(results[-1]["date_modified_gmt"])
+			ids = [
+				record["id"]
+				for record in results
+				if get_datetime(record["date_modified_gmt"]) >= page_last_modified
+			]
+			returned_ids = returned_ids + ids if page_last_modified == last_modified else ids
+			last_modified = page_last_modified
+
+			yield results
+
+			if len(results) < params["per_page"]:
+				return
+
+			params = {
+				**params,
+				"modified_after": (last_modified - timedelta(seconds=1)).strftime("%Y-%m-%dT%H:%M:%S"),
+				"dates_are_gmt": "true",
+				"exclude": ",".join(str(id) for id in returned_ids),
+			}
+
+	@staticmethod
+	def iter_pages(
+		wc_server: WooCommerceAPI, endpoint: str, params: Dict, first_page=None
+	) -> Iterator[List[Dict]]:
+		"""
+		Yields the pages of records of a WooCommerce list endpoint, in order.
+
+		The first page tells us how many pages there are (x-wp-totalpages). If the WooCommerce Server
+		allows concurrent requests, the remaining pages are fetched in parallel, keeping at most
+		max_concurrent_requests pages in flight so that memory stays bounded.
+
+		The response for the first page may be passed in if it has been requested already.
+		"""
+		if first_page is None:
+			first_page = get_page(wc_server, endpoint, params, page=1)
+		results, total_pages = parse_page_response(first_page)
+		if results:
+			yield results
+
+		# Some endpoints do not report the number of pages, walk them until a short page is returned
+		if total_pages is None:
+			page = 1
+			while len(results) >= params["per_page"]:
+				page += 1
+				results, _ = parse_page_response(get_page(wc_server, endpoint, params, page=page))
+				if results:
+					yield results
+			return
+
+		remaining_pages = iter(range(2, total_pages + 1))
+		max_workers = wc_server.max_concurrent_requests or 1
+
+		if max_workers <= 1:
+			for page in remaining_pages:
+				results, _ = parse_page_response(get_page(wc_server, endpoint, params, page=page))
+				if results:
+					yield results
+			return
+
+		executor = ThreadPoolExecutor(max_workers=max_workers)
+		try:
+			pending = deque(
+				submit_with_context(executor, get_page, wc_server, endpoint, params, page)
+				for page in islice(remaining_pages, max_workers)
+			)
+			while pending:
+				response = pending.popleft()
+				for page in islice(remaining_pages, 1):
+					pending.append(submit_with_context(executor, get_page, wc_server, endpoint, params, page))
+				results, _ = parse_page_response(response)
+				if results:
+					yield results
+		finally:
+			executor.shutdown(wait=True, cancel_futures=True)
 
 	@classmethod
 	def during_get_list_of_records(cls, record: Document, args):
 		return record
 
+	@classmethod
+	def get_doc_from_record(
+		cls, record: Dict, woocommerce_server_url: str, metadata: Optional[Dict] = None
+	) -> "WooCommerceResource":
+		"""
+		Returns a Document for a record received from WooCommerce other than through this API, such
+		as the payload of a webhook
+		"""
+		record = cls.pre_init_document(record, woocommerce_server_url=woocommerce_server_url)
+		cls.during_get_list_of_records(record, {"endpoint": None, "metadata": metadata or {}})
+		return frappe.get_doc(record)
+
+	@classmethod
+	def get_fields_param(cls, fields: List[str]) -> str:
+		"""
+		Returns the _fields parameter for a projection, which always includes the required_fields
+		"""
+		return ",".join(dict.fromkeys((*cls.required_fields, *fields)))
+
 	# use "args" despite frappe-semgrep-rules.rules.overusing-args, following convention in ERPNext
 	# nosemgrep
 	@classmethod
@@ -265,14 +587,11 @@ class WooCommerceResource(Document):
 		wc_api_list = cls._init_api()
 		total_count = 0
 
-		for wc_server in wc_api_list:
-			# Get WooCommerce Records
-			try:
-				response = wc_server.api.get(cls.resource)
-			except Exception as err:
-				log_and_raise_error(err, error_text="get_count failed")
-			if response.status_code != 200:
-				log_and_raise_error(error_text="get_count failed", response=response)
+		# Get WooCommerce Records from every API concurrently
+		responses = fan_out(wc_api_list, get_page, cls.resource, None)
+
+		for response in responses:
+			response = validate_page_response(response, error_text="get_count failed")
 
 			if "x-wp-total" in response.headers:
 				total_count += int(response.headers["x-wp-total"])
@@ -336,6 +655,11 @@ class WooCommerceResource(Document):
 
 		record = self.before_db_update(record)
 
+		# Only write the attributes that were loaded if the record was loaded with a projection
+		if self.projected_fields is not None:
+			loaded_fields = (*self.required_fields, *self.projected_fields)
+			record = {key: value for key, value in record.items() if key in loaded_fields}
+
 		# Drop fields with values that are unchanged
 		record_data_before_save = self._doc_before_save.to_dict()
 		record_before_save = self.deserialize_attributes_of_type_dict_or_list(record_data_before_save)
@@ -428,7 +752,7 @@ class WooCommerceResource(Document):
 		"""
 		Convert this Document to a dict
 		"""
-		doc_dict = {field.fieldname: self.get(field.fieldname) for field in self.meta.fields}
+		doc_dict = {fieldname: self.get(fieldname) for fieldname in get_fieldnames(self.doctype)}
 		doc_dict["name"] = self.name  # name field is not in meta.fields
 		return doc_dict
 
@@ -440,10 +764,9 @@ class WooCommerceResource(Document):
 		This function iterates over the fields of the input object that are expected to be in JSON format,
 		and if the field is present in the object, it transforms the field's value into a JSON-formatted string.
 		"""
-		json_fields = cls.get_json_fields()
-		for field in json_fields:
-			if field.fieldname in obj:
-				obj[field.fieldname] = json.dumps(obj[field.fieldname])
+		for fieldname in cls.get_json_fields():
+			if fieldname in obj:
+				obj[fieldname] = json.dumps(obj[fieldname])
 		return obj
 
 	@classmethod
@@ -454,24 +777,36 @@ class WooCommerceResource(Document):
 		This function iterates over the fields of the input object that are expected to be in JSON format,
 		and if the field is present in the object, it transforms the field's value from a JSON-formatted string.
 		"""
-		json_fields = cls.get_json_fields()
-		for field in json_fields:
-			if field.fieldname in obj and obj[field.fieldname]:
-				obj[field.fieldname] = json.loads(obj[field.fieldname])
+		for fieldname in cls.get_json_fields():
+			if fieldname in obj and obj[fieldname]:
+				obj[fieldname] = json.loads(obj[fieldname])
 		return obj
 
 	@classmethod
-	def get_json_fields(cls):
+	def get_json_fields(cls) -> Tuple[str, ...]:
 		"""
-		Returns a list of fields that have been defined with type "JSON"
+		Returns the names of fields that have been defined with type "JSON"
 		"""
-		fields = frappe.db.get_all(
-			"DocField",
-			{"parent": cls.doctype, "fieldtype": "JSON"},
-			["name", "fieldname", "fieldtype"],
-		)
+		return get_fieldnames(cls.doctype, fieldtype="JSON")
+
+
+def get_fieldnames(doctype: str, fieldtype: Optional[str] = None) -> Tuple[str, ...]:
+	"""
+	Returns the names of the fields of a doctype, optionally only those of the given fieldtype.
+
+	The result is memoised on the doctype's Meta, so it is discarded along with the Meta when the
+	doctype or its custom fields change.
+	"""
+	meta = frappe.get_meta(doctype)
+	fieldnames_by_type = meta.__dict__.get("_woocommerce_fieldnames")
+	if fieldnames_by_type is None:
+		fieldnames_by_type = {None: tuple(field.fieldname for field in meta.fields)}
+		for field in meta.fields:
+			fieldnames_by_type.setdefault(field.fieldtype, ())
+			fieldnames_by_type[field.fieldtype] += (field.fieldname,)
+		meta._woocommerce_fieldnames = fieldnames_by_type
 
-		return fields
+	return fieldnames_by_type.get(fieldtype, ())
 
 
 def generate_woocommerce_record_name_from_domain_and_id(
@@ -570,6 +905,80 @@ def get_wc_parameters_from_filters(filters):
 	return params
 
 
+def get_page(
+	wc_server: WooCommerceAPI, endpoint: str, params: Optional[Dict], page: Optional[int] = None
+):
+	"""
+	Request a single page of a WooCommerce list endpoint.
+
+	Only makes the HTTP request so that it is safe to run in a worker thread. Exceptions are returned
+	instead of raised, and are handled by validate_page_response.
+	"""
+	if page:
+		params = {**params, "page": page}
+	try:
+		if params is None:
+			return wc_server.api.get(endpoint)
+		return wc_server.api.get(endpoint, params=params)
+	except Exception as err:
+		return err
+
+
+def validate_page_response(response, error_text: str):
+	"""
+	Returns the response returned by get_page (or its Future), logging and raising an error if the
+	request failed
+	"""
+	if isinstance(response, Future):
+		response = response.result()
+	if isinstance(response, Exception):
+		try:
+			raise response
+		except Exception as err:
+			log_and_raise_error(err, error_text=error_text)
+	if response.status_code != 200:
+		log_and_raise_error(error_text=error_text, response=response)
+	return response
+
+
+def parse_page_response(response) -> Tuple[List[Dict], Optional[int]]:
+	"""
+	Returns the records and total number of pages from a page returned by get_page (or its Future)
+	"""
+	response = validate_page_response(response, error_text="iter_pages failed")
+	total_pages = (
+		int(response.headers["x-wp-totalpages"]) if "x-wp-totalpages" in response.headers else None
+	)
+	return response.json(), total_pages
+
+
+def fan_out(wc_api_list: List[WooCommerceAPI], fn, *args) -> List:
+	"""
+	Calls fn(wc_server, *args) for every WooCommerce server concurrently, and returns the results in
+	the order of wc_api_list. A list argument is taken to hold a separate value for every server.
+
+	fn should only make HTTP requests, see get_page.
+	"""
+	calls = [
+		[wc_server] + [arg[i] if isinstance(arg, list) else arg for arg in args]
+		for i, wc_server in enumerate(wc_api_list)
+	]
+	if len(calls) <= 1:
+		return [fn(*call_args) for call_args in calls]
+
+	with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+		futures = [submit_with_context(executor, fn, *call_args) for call_args in calls]
+	return [future.result() for future in futures]
+
+
+def submit_with_context(executor: ThreadPoolExecutor, fn, *args, **kwargs) -> Future:
+	"""
+	Submit a function to a thread pool, running it in a copy of the current context so that
+	frappe.local (site, flags, cache) is available in the worker thread
+	"""
+	return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
 def log_and_raise_error(exception=None, error_text=None, response=None):
 	"""
 	Create an "Error Log" and raise error
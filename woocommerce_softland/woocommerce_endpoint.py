@@ -1,7 +1,6 @@
 import base64
 import hashlib
 import hmac
-import json
 from http import HTTPStatus
 from typing import Optional, Tuple
 
@@ -9,32 +8,28 @@ import frappe
 from frappe import _
 from werkzeug.wrappers import Response
 
-from woocommerce_softland.tasks.sync_sales_orders import run_sales_order_sync
-from woocommerce_softland.woocommerce.woocommerce_api import (
-	WC_RESOURCE_DELIMITER,
-	parse_domain_from_url,
-)
+from woocommerce_softland.tasks.webhooks import enqueue_webhook_delivery_drain
+from woocommerce_softland.woocommerce.woocommerce_api import parse_domain_from_url
 
 
 def validate_request() -> Tuple[bool, Optional[HTTPStatus], Optional[str]]:
-	# Get relevant WooCommerce Server
+	# Get the secret and creation user of the relevant WooCommerce Server from the cache
 	try:
 		webhook_source_url = frappe.get_request_header("x-wc-webhook-source", "")
-		wc_server = frappe.get_doc("WooCommerce Server", parse_domain_from_url(webhook_source_url))
+		secret, creation_user = frappe.get_cached_value(
+			"WooCommerce Server", parse_domain_from_url(webhook_source_url), ["secret", "creation_user"]
+		)
 	except Exception:
 		return False, HTTPStatus.BAD_REQUEST, _("Missing Header")
 
 	# Validate secret
-	sig = base64.b64encode(
-		hmac.new(wc_server.secret.encode("utf8"), frappe.request.data, hashlib.sha256).digest()
-	)
-	# if (
-	# 	frappe.request.data
-	# 	and not sig == frappe.get_request_header("x-wc-webhook-signature", "").encode()
-	# ):
-	# 	return False, HTTPStatus.UNAUTHORIZED, _("Unauthorized")
+	sig = base64.b64encode(hmac.new(secret.encode("utf8"), frappe.request.data, hashlib.sha256).digest())
+	if frappe.request.data and not hmac.compare_digest(
+		sig, frappe.get_request_header("x-wc-webhook-signature", "").encode()
+	):
+		return False, HTTPStatus.UNAUTHORIZED, _("Unauthorized")
 
-	frappe.set_user(wc_server.creation_user)
+	frappe.set_user(creation_user)
 	return True, None, None
 
 
@@ -43,26 +38,85 @@ def order_created(*args, **kwargs):
 	"""
 	Accepts payload data from WooCommerce "Order Created" webhook
 	"""
+	return receive_webhook("order", "created")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def order_updated(*args, **kwargs):
+	"""
+	Accepts payload data from WooCommerce "Order Updated" webhook
+	"""
+	return receive_webhook("order", "updated")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def order_deleted(*args, **kwargs):
+	"""
+	Accepts payload data from WooCommerce "Order Deleted" webhook
+	"""
+	return receive_webhook("order", "deleted")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def product_created(*args, **kwargs):
+	"""
+	Accepts payload data from WooCommerce "Product Created" webhook
+	"""
+	return receive_webhook("product", "created")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def product_updated(*args, **kwargs):
+	"""
+	Accepts payload data from WooCommerce "Product Updated" webhook
+	"""
+	return receive_webhook("product", "updated")
+
+
+@frappe.whitelist(allow_guest=True, methods=["POST"])
+def product_deleted(*args, **kwargs):
+	"""
+	Accepts payload data from WooCommerce "Product Deleted" webhook
+	"""
+	return receive_webhook("product", "deleted")
+
+
+def receive_webhook(resource: str, event: str) -> Response:
+	"""
+	Stores the raw payload of a WooCommerce webhook for a resource and event, to be parsed and
+	synchronised in the background.
+
+	WooCommerce disables webhooks that take too long to respond, so no more work than necessary is
+	done before responding.
+	"""
 	valid, status, msg = validate_request()
 	if not valid:
 		return Response(response=msg, status=status)
 
-	if frappe.request and frappe.request.data:
-		try:
-			order = json.loads(frappe.request.data)
-		except ValueError:
-			# woocommerce returns 'webhook_id=value' for the first request which is not JSON
-			order = frappe.request.data
-		event = frappe.get_request_header("x-wc-webhook-event")
-	else:
+	if not (frappe.request and frappe.request.data):
 		return Response(response=_("Missing Header"), status=HTTPStatus.BAD_REQUEST)
 
-	if event == "created":
-		webhook_source_url = frappe.get_request_header("x-wc-webhook-source", "")
-		woocommerce_order_name = (
-			f"{parse_domain_from_url(webhook_source_url)}{WC_RESOURCE_DELIMITER}{order['id']}"
-		)
-		frappe.enqueue(run_sales_order_sync, queue="long", woocommerce_order_name=woocommerce_order_name)
-		return Response(status=HTTPStatus.OK)
-	else:
+	if frappe.get_request_header("x-wc-webhook-event") != event:
 		return Response(response=_("Event not supported"), status=HTTPStatus.BAD_REQUEST)
+
+	# Store the payload, so that the record can be synchronised from it without retrieving it again.
+	# The WooCommerce ID is set from the payload by the background job.
+	delivery = frappe.new_doc("WooCommerce Webhook Delivery")
+	delivery.update(
+		{
+			"woocommerce_server": parse_domain_from_url(
+				frappe.get_request_header("x-wc-webhook-source", "")
+			),
+			"topic": f"{resource}.{event}",
+			"delivery_id": frappe.get_request_header("x-wc-webhook-delivery-id"),
+			"payload": frappe.request.data.decode("utf8"),
+		}
+	)
+	try:
+		delivery.db_insert()
+	except frappe.UniqueValidationError:
+		# WooCommerce may send a delivery more than once, it is only stored once
+		return Response(status=HTTPStatus.OK)
+
+	enqueue_webhook_delivery_drain(enqueue_after_commit=True)
+	return Response(status=HTTPStatus.OK)